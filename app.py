@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 import threading
 import time
@@ -6,16 +7,18 @@ import wave
 
 import numpy as np
 import pyaudio
-import torch
-import torchaudio
-from PySide2.QtCore import Qt, QObject, Signal, QThread
+from PySide2.QtCore import Qt, QObject, Signal
 from PySide2.QtGui import QIcon
 from PySide2.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QLabel, \
     QMessageBox
 
 import util
 from live2d_module import Live2DWidget
+from model_loader import ModelLoader, warmup_whisper, warmup_vits
 from resources import resource_loader
+from speech_pipeline import SpeechPipeline
+from speech_worker import SpeechWorker, SpeechRequest
+from tracing import tracer
 from stt_module.whisper import Whisper
 from tts_module.vits import ViTs
 from ttt_module.openai_model import GPT
@@ -24,49 +27,34 @@ logging.basicConfig(level=logging.INFO)
 
 
 class AsyncSpeechTask(QObject):
-    finished = Signal(str)
+    # 完成时发送 (文本, AudioBuffer)
+    finished = Signal(str, object)
+    # 流水线模式下每段开始播放时发送 (文本, AudioBuffer)
+    segment_started = Signal(str, object)
 
-    def __init__(self, ttt, stt, tts, message, audio):
+    def __init__(self, ttt, stt, tts, message, audio, pipelined=False, save_path=None, cancelled=None,
+                 request_id=None):
         super(AsyncSpeechTask, self).__init__()
-        self.ttt = ttt
-        self.stt = stt
-        self.tts = tts
-        # self.tts_stream = StreamTTSPlayer(tts)
         self.message = message
         self.audio = audio
+        self.pipeline = SpeechPipeline(ttt, stt, tts, pipelined=pipelined, save_path=save_path,
+                                       cancelled=cancelled, request_id=request_id,
+                                       on_segment_start=lambda idx, chunk, speech: self.segment_started.emit(
+                                           chunk, speech))
 
     # 异步执行
     def run(self):
         logging.info('Run async')
-        if self.message:
-            pass
-        else:
-            self.message = self.stt.translate(self.audio, origin_rate=44100, language='Chinese')[0]
-            logging.info(f'translate message: {self.message}')
-        response = self.ttt.ask(self.message)
-        logging.info(response)
-
-        speech_data = np.array([])
-        chunks = []
-        for lang, chunk in util.split_text_by_language(response):
-            if lang == 'ZH':
-                ls = 0.9
-            else:
-                ls = 1.25
-            chunks.append(chunk)
-            chunk = f'[{lang}]{chunk}[{lang}]'
-            speech = self.tts.generate_speech(chunk, ls=ls)
-            speech_data = np.concatenate([speech_data, speech], axis=0)
-
-        torchaudio.save(resource_loader.get_path('audio', 'tmp', 'out.wav'),
-                        torch.from_numpy(speech_data).unsqueeze(dim=0),
-                        sample_rate=22050, encoding='PCM_S')
-
-        # 完成任务后发送信号
-        self.finished.emit(''.join(chunks))
+        result = self.pipeline.run(self.message, self.audio)
+        # 完成任务后发送信号，被取消的任务不再播放
+        if result is not None:
+            self.finished.emit(*result)
 
 
 class Live2DApp(QWidget):
+    # 模型在后台加载完成时发送 (模型名, 是否成功)，在 UI 线程中处理
+    model_ready = Signal(str, bool)
+
     def __init__(self, args):
         super().__init__()
 
@@ -74,15 +62,22 @@ class Live2DApp(QWidget):
                        system_prompt=resource_loader.load_text('prompt.txt'))
         # 保存上下文
         self.llm.start_queue()
-        print('loading whisper')
-        self.whisper = Whisper(args['whisper_folder'], device='cuda')
-        print('loading vits')
-        self.vits = ViTs(resource_loader.get_path('vits', 'config', 'config.json'),
-                         resource_loader.get_path('vits', 'pretrained_models', 'info.json'),
-                         resource_loader.get_path('vits', 'pretrained_models'),
-                         device='cuda')
+        # Whisper 和 ViTs 在后台并行加载并预热，窗口先显示，对应的按钮在模型就绪后启用
         self.speaker = '天童爱丽丝'
-        self.vits.load_model(self.speaker)
+        self.model_loader = ModelLoader()
+        self.model_loader.load('whisper', lambda: Whisper(args['whisper_folder'], device='cuda'),
+                               warmup=warmup_whisper)
+        self.model_loader.load('vits', self.load_vits, warmup=warmup_vits)
+        # 边生成边播放
+        self.pipelined = args.get('pipelined', True)
+        # 是否把每次回复的语音另存为 wav，只在后台进行
+        self.save_wav = args.get('save_wav', False)
+        # 常驻的请求处理线程，新消息会取消还在排队或处理中的旧消息
+        self.speech_worker = SpeechWorker(self.run_speech_task).start()
+        # 各阶段耗时写入 json lines 文件，退出时另存一份 Chrome trace 格式
+        self.trace_file = args.get('trace_file')
+        if self.trace_file:
+            tracer.open(self.trace_file)
 
         self.setWindowTitle("Live2D Chat Interface")
         self.setGeometry(100, 100, 1200, 1200)
@@ -108,8 +103,9 @@ class Live2DApp(QWidget):
         self.text_input.setFixedHeight(100)  # 设置高度
         self.chat_layout.addWidget(self.text_input)
 
-        # 发送按钮
+        # 发送按钮，ViTs 就绪后启用
         self.send_button = QPushButton("发送", self)
+        self.send_button.setEnabled(False)
         self.send_button.clicked.connect(self.send_message)
         self.chat_layout.addWidget(self.send_button)
 
@@ -117,13 +113,14 @@ class Live2DApp(QWidget):
         self.record_layout = QVBoxLayout()
         self.chat_layout.addLayout(self.record_layout)
 
-        # 录音按钮
+        # 录音按钮，Whisper 就绪后启用
         self.record_button = QPushButton("录音", self)
+        self.record_button.setEnabled(False)
         self.record_button.clicked.connect(self.toggle_recording)
         self.record_layout.addWidget(self.record_button)
 
         # 录音状态标签
-        self.record_status = QLabel("未录音", self)
+        self.record_status = QLabel("模型加载中...", self)
         self.record_status.setAlignment(Qt.AlignCenter)  # 居中对齐
         self.record_layout.addWidget(self.record_status)
 
@@ -138,30 +135,99 @@ class Live2DApp(QWidget):
         self.audio_data = None
         self.start_time = None  # 录音开始时间
 
-    def on_speech_generate_finish(self, result):
+        self.model_ready.connect(self.on_model_ready)
+        for name in ('whisper', 'vits'):
+            self.model_loader.add_ready_callback(name, lambda name, model: self.model_ready.emit(name,
+                                                                                              model is not None))
+
+    def load_vits(self):
+        # 在加载线程中执行
+        vits = ViTs(resource_loader.get_path('vits', 'config', 'config.json'),
+                    resource_loader.get_path('vits', 'pretrained_models', 'info.json'),
+                    resource_loader.get_path('vits', 'pretrained_models'),
+                    device='cuda')
+        vits.load_model(self.speaker)
+        return vits
+
+    @property
+    def whisper(self):
+        return self.model_loader.get('whisper')
+
+    @property
+    def vits(self):
+        return self.model_loader.get('vits')
+
+    def on_model_ready(self, name, success):
+        if not success:
+            QMessageBox.warning(self, "错误", f"{name} 模型加载失败")
+            return
+        if name == 'vits':
+            self.send_button.setEnabled(True)
+        elif name == 'whisper':
+            self.record_button.setEnabled(True)
+        if self.model_loader.is_ready('whisper') and self.model_loader.is_ready('vits') \
+                and not self.is_recording and self.audio_data is None:
+            self.record_status.setText('未录音')
+
+    def on_speech_generate_finish(self, result, speech):
         print('Finish generate speech')
-        util.play_audio(resource_loader.get_path('audio', 'tmp', 'out.wav'))
-        self.live2d_window.speech(result, resource_loader.get_path('audio', 'tmp', 'out.wav'))
+        if self.pipelined:
+            # 流水线模式下各段已经在生成时播放过了
+            return
+        util.play_audio(speech)
+        self.live2d_window.speech(result, speech)
+
+    def on_speech_segment_start(self, text, speech):
+        self.live2d_window.speech(text, speech)
+
+    def run_speech_task(self, request):
+        # 在 speech_worker 的线程中执行
+        # 只有语音输入才等待 whisper 加载，文字消息在 whisper 未就绪或加载失败时也能发送
+        stt = self.whisper if not request.message and request.audio is not None else None
+        speech_task = AsyncSpeechTask(self.llm, stt, self.vits, request.message, request.audio,
+                                      pipelined=self.pipelined,
+                                      save_path=resource_loader.get_path('audio', 'tmp', 'out.wav')
+                                      if self.save_wav else None,
+                                      cancelled=request.cancelled,
+                                      request_id=request.id)
+        speech_task.finished.connect(self.on_speech_generate_finish)
+        speech_task.segment_started.connect(self.on_speech_segment_start)
+        speech_task.run()
 
     def send_message(self):
         # 发送按钮点击后执行的函数
         if self.text_input.text() or self.audio_data is not None:
-            self.speech_task = AsyncSpeechTask(self.llm, self.whisper, self.vits, self.text_input.text(),
-                                               None if self.audio_data is None else self.audio_data.copy())
-            self.speech_task.finished.connect(self.on_speech_generate_finish)
-            self.thread = QThread(self)
-            self.speech_task.moveToThread(self.thread)
-            self.thread.started.connect(self.speech_task.run)
-            self.thread.start()
+            self.barge_in()
+            self.speech_worker.submit(SpeechRequest(self.text_input.text(),
+                                                    None if self.audio_data is None else self.audio_data.copy()))
+            stats = self.speech_worker.get_stats()
+            logging.info(f"speech queue depth: {stats['queue_depth']}, avg wait: {stats['avg_wait']:.3f}s")
 
             self.text_input.clear()
             self.audio_data = None
             self.record_status.setText('未录音')
             self.play_button.setEnabled(False)
 
+    def barge_in(self):
+        """
+        用户开始说话或发送新消息时打断正在进行的回复：取消模型请求和语音合成，并立即停止播放
+        """
+        self.speech_worker.cancel_all()
+        util.stop_audio()
+        self.live2d_window.stop_speech()
+
+    def closeEvent(self, event):
+        self.speech_worker.stop()
+        self.model_loader.shutdown()
+        if self.trace_file:
+            tracer.close()
+            tracer.export_chrome(os.path.splitext(self.trace_file)[0] + '.chrome.json')
+        super().closeEvent(event)
+
     def toggle_recording(self):
         if not self.is_recording:
-            # 开始录音
+            # 开始录音，打断正在进行的回复
+            self.barge_in()
             self.is_recording = True
             self.audio_data = []
             self.record_button.setText("停止录音")
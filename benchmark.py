@@ -0,0 +1,286 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+import util
+from model_loader import ModelLoader, warmup_whisper, warmup_vits
+from resources import resource_loader
+from speech_pipeline import SpeechPipeline
+from stt_module.whisper import Whisper
+from tracing import tracer, percentile
+from tts_module.vits import ViTs
+from tts_module.vits.precision import PRECISION_POLICIES
+from ttt_module.local_server import LocalChatServer
+from ttt_module.openai_model import GPT
+
+# 与基准相比允许的变化比例，超出视为性能回退
+DEFAULT_TOLERANCE = 0.1
+
+
+# 端到端延迟基准：按脚本化的对话文件无界面地跑完整的 语音识别 -> 对话 -> 语音合成 链路，
+# 对话模型用本地的 LocalChatServer 代替，回复和生成速度固定，结果可以重复对比
+# 对话文件格式
+# {
+#     "token_delay": 0.03,
+#     "first_token_delay": 0.3,
+#     "turns": [
+#         {"text": "你好", "reply": "[ZH]你好呀[ZH][JA]こんにちは[JA]"},
+#         {"audio": "input.wav", "reply": "[ZH]听到了[ZH]"}
+#     ]
+# }
+# audio 为预先录好的 wav，相对路径相对于对话文件所在目录
+# 示例用法
+# python benchmark.py resources/benchmark/conversation.json --runs 5 --save-baseline baseline.json
+# python benchmark.py resources/benchmark/conversation.json --runs 5 --baseline baseline.json
+class ConversationBenchmark:
+    def __init__(self, conversation, stt, tts, pipelined=True, token_delay=None, first_token_delay=None):
+        """
+        :param conversation: 对话文件的内容
+        :param token_delay: 覆盖对话文件中的 token_delay
+        :param first_token_delay: 覆盖对话文件中的 first_token_delay
+        """
+        self.turns = conversation['turns']
+        self.stt = stt
+        self.tts = tts
+        self.pipelined = pipelined
+        self.token_delay = conversation.get('token_delay', 0.0) if token_delay is None else token_delay
+        self.first_token_delay = conversation.get('first_token_delay', 0.0) \
+            if first_token_delay is None else first_token_delay
+
+    def run(self, runs=5, warmup_runs=1):
+        """
+        :return: {'turns': 每轮的结果, 'runs': 每次运行的结果}，预热的运行不计入
+        """
+        server = LocalChatServer([turn['reply'] for turn in self.turns], token_delay=self.token_delay,
+                                 first_token_delay=self.first_token_delay).start()
+        turn_results = []
+        run_results = []
+        try:
+            for run in range(warmup_runs + runs):
+                warmup = run < warmup_runs
+                # 每次运行使用新的上下文
+                llm = GPT('local', 1024, base_url=server.base_url)
+                llm.start_queue()
+                with RssSampler() as sampler:
+                    results = [self.run_turn(llm, run, i, turn) for i, turn in enumerate(self.turns)]
+                logging.info(f"run {run}{' (warm-up)' if warmup else ''}: "
+                             f"ttfa {[round(r['ttfa'], 3) for r in results]}")
+                if warmup:
+                    continue
+                turn_results.extend(results)
+                run_results.append({'run': run - warmup_runs, 'peak_rss_mb': sampler.peak_mb,
+                                    'process_peak_rss_mb': process_peak_rss_mb()})
+        finally:
+            server.stop()
+        return {'turns': turn_results, 'runs': run_results}
+
+    def run_turn(self, llm, run, idx, turn):
+        request_id = f'bench-{run}-{idx}'
+        pipeline = SpeechPipeline(llm, self.stt, self.tts, pipelined=self.pipelined, play=False,
+                                  request_id=request_id)
+        if 'audio' in turn:
+            audio = turn['audio'].to_mono()
+            pipeline.run(audio=audio.samples.astype(np.float32), origin_rate=audio.sample_rate)
+        else:
+            pipeline.run(message=turn['text'])
+
+        events = [e for e in tracer.get_events() if e['args'].get('request_id') == request_id]
+        request = next(e for e in events if e['name'] == 'request')
+        first_audio = next((e for e in events if e['name'] == 'first_audio'), None)
+        # 流水线模式逐段合成，非流水线模式整条回复一个 batch
+        segments = [e for e in events if e['name'] in ('tts.segment', 'tts.batch')]
+        audio_duration = sum(e['args']['audio_duration'] for e in segments)
+        return {
+            'run': run,
+            'turn': idx,
+            'ttfa': first_audio['args']['ttfa'] if first_audio is not None else request['duration'],
+            'total': request['duration'],
+            # 整轮回复的合成耗时 / 音频时长
+            'rtf': sum(e['duration'] for e in segments) / audio_duration if audio_duration else 0.0,
+            'audio_duration': audio_duration,
+            'segments': len(segments)
+        }
+
+
+def summarize(results):
+    """
+    :return: {指标名: 数值}，时间单位秒，内存单位 MB
+    """
+    summary = {}
+    for key in ('ttfa', 'total', 'rtf'):
+        values = sorted(r[key] for r in results['turns'])
+        summary[f'{key}_p50'] = percentile(values, 50)
+        summary[f'{key}_p95'] = percentile(values, 95)
+    # 各次运行期间采样到的最大常驻内存
+    summary['peak_rss_mb'] = max((r['peak_rss_mb'] for r in results['runs']), default=0.0)
+    # 进程启动以来的最大值，包括模型加载
+    summary['process_peak_rss_mb'] = max((r['process_peak_rss_mb'] for r in results['runs']), default=0.0)
+    return summary
+
+
+def compare(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    所有指标都是越小越好
+    :return: 回退的指标 [(指标名, 基准值, 当前值)]
+    """
+    regressions = []
+    for key, base in baseline.items():
+        if key not in summary:
+            continue
+        if summary[key] > base * (1 + tolerance):
+            regressions.append((key, base, summary[key]))
+    return regressions
+
+
+def current_rss_mb():
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+# 在后台线程中定期采样当前常驻内存，得到一段时间内的峰值；ru_maxrss 是进程启动以来的峰值，不会随每次运行下降
+# 示例用法
+# with RssSampler() as sampler:
+#     run()
+# print(sampler.peak_mb)
+class RssSampler:
+    def __init__(self, interval=0.01):
+        """
+        :param interval: 采样间隔，秒
+        """
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def process_peak_rss_mb():
+    # 进程启动以来的最大常驻内存
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+    import psutil
+    return psutil.Process().memory_info().peak_wset / 1024 / 1024
+
+
+def load_conversation(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        conversation = json.load(f)
+    # 预先读入录音，不计入延迟
+    for turn in conversation['turns']:
+        if 'audio' in turn:
+            turn['audio'] = util.AudioBuffer.load(os.path.join(os.path.dirname(path), turn['audio']))
+    return conversation
+
+
+def load_models(args, need_stt):
+    loader = ModelLoader()
+    if need_stt:
+        loader.load('whisper', lambda: Whisper(args.whisper_folder, device=args.device), warmup=warmup_whisper)
+
+    def load_vits():
+        vits = ViTs(resource_loader.get_path('vits', 'config', 'config.json'),
+                    resource_loader.get_path('vits', 'pretrained_models', 'info.json'),
+                    resource_loader.get_path('vits', 'pretrained_models'),
+                    device=args.device, backend=args.backend, quantize=args.quantize,
+                    precision=args.precision, compiled=args.compiled, frontend_workers=args.frontend_workers)
+        vits.load_model(args.speaker)
+        return vits
+
+    loader.load('vits', load_vits, warmup=warmup_vits)
+    models = loader.wait_all()
+    loader.shutdown()
+    return models.get('whisper'), models['vits']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端对话延迟基准')
+    parser.add_argument('conversation', type=str, help='对话文件')
+    parser.add_argument('-c', '--config', type=str, default='config.json')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warmup-runs', type=int, default=1)
+    parser.add_argument('--serial', action='store_true', help='等整条回复生成完再合成')
+    parser.add_argument('--token-delay', type=float, default=None)
+    parser.add_argument('--first-token-delay', type=float, default=None)
+    parser.add_argument('--device', type=str, default=None)
+    parser.add_argument('--speaker', type=str, default='天童爱丽丝')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx'], help='语音合成的推理后端')
+    parser.add_argument('--quantize', type=str, default=None, choices=['dynamic', 'static'],
+                        help='int8 量化，需要 --backend onnx')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISION_POLICIES),
+                        help='语音合成的精度策略，需要 --backend torch')
+    parser.add_argument('--compiled', action='store_true', help='用 torch.compile 编译语音合成，需要 --backend torch')
+    parser.add_argument('--frontend-workers', type=int, default=0, help='文本前端的工作进程数，0 时在合成线程中处理')
+    parser.add_argument('--output', type=str, default=None, help='保存每轮的详细结果')
+    parser.add_argument('--baseline', type=str, default=None, help='与基准 json 对比，有回退时返回 1')
+    parser.add_argument('--save-baseline', type=str, default=None)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    config = util.load_config(args.config) if os.path.exists(args.config) else {}
+    args.whisper_folder = config.get('whisper_folder')
+    args.device = args.device or config.get('device', 'cuda')
+
+    conversation = load_conversation(args.conversation)
+    stt, tts = load_models(args, any('audio' in turn for turn in conversation['turns']))
+    benchmark = ConversationBenchmark(conversation, stt, tts, pipelined=not args.serial,
+                                      token_delay=args.token_delay, first_token_delay=args.first_token_delay)
+    results = benchmark.run(args.runs, args.warmup_runs)
+    summary = summarize(results)
+
+    print(f"{'metric':<20}{'value':>12}")
+    for key, value in summary.items():
+        print(f'{key:<20}{value:>12.3f}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, **results}, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.tolerance)
+        for key, base, value in regressions:
+            change = f' (+{(value / base - 1) * 100:.1f}%)' if base else ''
+            print(f'REGRESSION {key}: {base:.3f} -> {value:.3f}{change}')
+        if regressions:
+            sys.exit(1)
+        print('no regression')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
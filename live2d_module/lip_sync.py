@@ -17,6 +17,8 @@ class WavHandler:
         self.pcmData: np.ndarray = None
         # 已经读取的帧数
         self.lastOffset: int = 0
+        # 标准化系数
+        self.peak: float = 1.0
         # 当前rms值
         self.currentRms: float = 0
         # 开始读取的时间
@@ -33,8 +35,8 @@ class WavHandler:
                 # 双声道 / 单声道
                 self.pcmData = np.frombuffer(wav.readframes(self.numFrames),
                                              dtype=np.int16 if self.sampleWidth == 2 else np.int32)
-                # 标准化
-                self.pcmData = self.pcmData / np.max(np.abs(self.pcmData))
+                # 标准化系数，计算 rms 时再除，不复制整段数据
+                self.peak = float(np.max(np.abs(self.pcmData)))
                 # 拆分通道
                 self.pcmData = self.pcmData.reshape(-1, self.numChannels).T
 
@@ -45,6 +47,24 @@ class WavHandler:
             Info(f"[LipSync]Failed to load wav file due to exception: {e}")
             self.ReleasePcmData()
 
+    def StartBuffer(self, audio) -> None:
+        """
+        直接读取内存中的 AudioBuffer，使用其数据的视图，不经过 wav 文件也不复制
+        """
+        self.ReleasePcmData()
+        if audio.num_frames == 0:
+            return
+        self.numFrames = audio.num_frames
+        self.sampleRate = audio.sample_rate
+        self.sampleWidth = audio.dtype.itemsize
+        self.numChannels = audio.num_channels
+        self.peak = float(np.max(np.abs(audio.samples)))
+        # 拆分通道
+        self.pcmData = audio.samples.reshape(self.numFrames, self.numChannels).T
+
+        self.startTime = time.time()
+        self.lastOffset = 0
+
     def ReleasePcmData(self):
         if self.pcmData is not None:
             del self.pcmData
@@ -83,7 +103,7 @@ class WavHandler:
 
         dataFragment = self.pcmData[:, self.lastOffset:currentOffset].astype(np.float64)
 
-        self.currentRms = np.sqrt(np.mean(np.square(dataFragment)))
+        self.currentRms = np.sqrt(np.mean(np.square(dataFragment))) / self.peak if self.peak > 0 else 0
 
         self.lastOffset = currentOffset
         return True
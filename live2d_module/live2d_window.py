@@ -74,9 +74,15 @@ class OpenGLLive2DWidget(QOpenGLWidget):
             live2d.clearBuffer(1.0, 1.0, 1.0, 0.0)
             self.model.Draw()
 
-    def speech(self, audio_path):
+    def speech(self, audio):
         log.Info("start lipSync")
-        self.wavHandler.Start(audio_path)
+        if isinstance(audio, str):
+            self.wavHandler.Start(audio)
+        else:
+            self.wavHandler.StartBuffer(audio)
+
+    def stop_speech(self):
+        self.wavHandler.ReleasePcmData()
 
     def resizeGL(self, w, h):
         # 调整视口大小
@@ -217,7 +223,7 @@ class Live2DWidget(QWidget):
     def hide_speech_bubble(self):
         self.speech_bubble.hide()  # 隐藏气泡
 
-    def speech(self, text, audio_path):
+    def speech(self, text, audio):
         self.opengl_widget.idle(_random=True)
 
         self.speech_bubble.setText(text)
@@ -229,7 +235,12 @@ class Live2DWidget(QWidget):
 
         self.speech_bubble.move(x, y)
 
-        self.opengl_widget.speech(audio_path)
+        self.opengl_widget.speech(audio)
 
         # 启动定时器，6秒后自动隐藏
         self.timer.start(6000)
+
+    def stop_speech(self):
+        self.timer.stop()
+        self.hide_speech_bubble()
+        self.opengl_widget.stop_speech()
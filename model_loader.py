@@ -0,0 +1,100 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from tracing import tracer
+
+
+# 在后台线程中并行加载多个模型，每个模型对应一个 Future，加载完成后执行一次预热推理
+# 启动时间取决于最慢的那个模型，而不是所有模型加载时间之和
+# 示例用法
+# loader = ModelLoader()
+# loader.load('whisper', lambda: Whisper(path), warmup=lambda m: m.translate(silence, origin_rate=16000))
+# loader.add_ready_callback('whisper', lambda name, model: print(name, 'ready'))
+# whisper = loader.get('whisper')  # 阻塞直到加载完成
+class ModelLoader:
+    def __init__(self, max_workers=None):
+        """
+        :param max_workers: 同时加载的模型数，默认 4
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or 4, thread_name_prefix='ModelLoader')
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def load(self, name, load_fn, warmup=None):
+        """
+        :param name: 模型名
+        :param load_fn: 创建模型的函数，在后台线程中执行
+        :param warmup: 加载后执行的预热函数 warmup(model)，失败时只记录日志
+        :return: concurrent.futures.Future，结果为模型对象
+        """
+        with self.lock:
+            future = self.executor.submit(self._load, name, load_fn, warmup)
+            self.futures[name] = future
+        return future
+
+    def _load(self, name, load_fn, warmup):
+        with tracer.span('model.load', model=name) as trace_args:
+            t1 = perf_counter()
+            model = load_fn()
+            trace_args['load_time'] = perf_counter() - t1
+            logging.info(f'{name} loaded in {trace_args["load_time"]:.2f}s')
+            if warmup is not None:
+                # 第一次推理通常要初始化 kernel 和缓存，预热后用户的第一条请求不用承担这部分耗时
+                t2 = perf_counter()
+                try:
+                    warmup(model)
+                except Exception:
+                    logging.exception(f'{name} warm-up failed')
+                trace_args['warmup_time'] = perf_counter() - t2
+                logging.info(f'{name} warmed up in {trace_args["warmup_time"]:.2f}s')
+        return model
+
+    def future(self, name):
+        with self.lock:
+            return self.futures[name]
+
+    def get(self, name, timeout=None):
+        """
+        获取模型，未加载完成时阻塞，加载失败时抛出加载时的异常
+        """
+        return self.future(name).result(timeout)
+
+    def is_ready(self, name):
+        with self.lock:
+            future = self.futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def add_ready_callback(self, name, callback):
+        """
+        :param callback: 加载完成时的回调 callback(name, model)，加载失败时 model 为 None；
+                         在加载线程中执行，已完成时立即在当前线程执行
+        """
+        def done(future):
+            if future.exception() is not None:
+                logging.error(f'{name} failed to load: {future.exception()!r}')
+                callback(name, None)
+            else:
+                callback(name, future.result())
+
+        self.future(name).add_done_callback(done)
+
+    def wait_all(self, timeout=None):
+        with self.lock:
+            names = list(self.futures)
+        return {name: self.get(name, timeout) for name in names}
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
+
+
+def warmup_whisper(whisper):
+    # 1 秒静音
+    whisper.translate(np.zeros(16000, dtype=np.float32), origin_rate=16000, language='Chinese')
+
+
+def warmup_vits(vits):
+    vits.generate_speech('[ZH]你好[ZH]')
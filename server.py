@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, File, Header, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+import util
+from model_loader import ModelLoader, warmup_whisper, warmup_vits
+from resources import resource_loader
+from session_manager import SessionManager
+from speech_pipeline import SpeechPipeline, LENGTH_SCALES
+from speech_worker import FairScheduler
+from stt_module.whisper import Whisper
+from tts_module.vits import ViTs
+from ttt_module.openai_model import GPT
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ChatRequest(BaseModel):
+    text: str
+
+
+class SynthesizeRequest(BaseModel):
+    # 带 [ZH]/[JA] 标签的文本，或者配合 lang 使用的纯文本
+    text: str
+    lang: str = None
+
+
+class SpeechModels:
+    """
+    进程内只加载一次的模型，所有会话共用；对话上下文按会话隔离
+    """
+
+    def __init__(self, args):
+        device = args.get('device', 'cuda')
+        system_prompt = resource_loader.load_text('prompt.txt')
+
+        def create_llm():
+            llm = GPT(args['api_key'], 1024, model=args.get('model', 'gpt-4o-mini'), system_prompt=system_prompt,
+                      base_url=args.get('base_url'), max_history=args.get('max_history', 20))
+            # 保存上下文
+            llm.start_queue()
+            return llm
+
+        self.sessions = SessionManager(create_llm, idle_timeout=args.get('session_idle_timeout', 600),
+                                       max_sessions=args.get('max_sessions', 100)).start()
+        # 各会话的识别和合成请求按会话轮流执行
+        self.scheduler = FairScheduler().start()
+        # WebSocket 的语音对话单独使用一个线程池，每个会话最多占用一个线程，不影响其他接口
+        self.speech_executor = ThreadPoolExecutor(args.get('speech_workers', 4), thread_name_prefix='speech')
+        self.speaker = args.get('speaker', '天童爱丽丝')
+
+        def load_vits():
+            vits = ViTs(resource_loader.get_path('vits', 'config', 'config.json'),
+                        resource_loader.get_path('vits', 'pretrained_models', 'info.json'),
+                        resource_loader.get_path('vits', 'pretrained_models'),
+                        device=device, backend=args.get('tts_backend', 'torch'),
+                        quantize=args.get('tts_quantize'), precision=args.get('tts_precision', 'fp32'),
+                        compiled=args.get('tts_compiled', False),
+                        text_cache_path=args.get('tts_text_cache'), seed=args.get('tts_seed'),
+                        wave_cache_dir=args.get('tts_wave_cache'),
+                        frontend_workers=args.get('tts_frontend_workers', 0),
+                        jieba_cache_dir=args.get('tts_jieba_cache'))
+            vits.load_model(self.speaker)
+            return vits
+
+        # 两个模型并行加载并预热，全部就绪后才开始接受请求
+        loader = ModelLoader()
+        loader.load('whisper', lambda: Whisper(args['whisper_folder'], device=device), warmup=warmup_whisper)
+        loader.load('vits', load_vits, warmup=warmup_vits)
+        self.whisper = loader.get('whisper')
+        self.vits = loader.get('vits')
+        loader.shutdown()
+
+    def stt(self, session_id):
+        return self.scheduler.bind(session_id, self.whisper)
+
+    def tts(self, session_id):
+        return self.scheduler.bind(session_id, self.vits)
+
+    def transcribe(self, audio, language='Chinese', session_id=None):
+        audio = audio.to_mono()
+        # 与桌面端录音一致，传入未归一化的 float32 采样
+        return self.stt(session_id).translate(audio.samples.astype(np.float32), origin_rate=audio.sample_rate,
+                                              language=language)[0]
+
+    def synthesize(self, text, lang=None, session_id=None):
+        if lang is not None:
+            segments = [(lang, text)]
+        else:
+            segments = util.split_text_by_language(text)
+        if not segments:
+            raise ValueError('文本中没有 [ZH]/[JA] 标签，请指定 lang')
+        wavs = self.tts(session_id).generate_speech_batch([f'[{seg_lang}]{chunk}[{seg_lang}]'
+                                                           for seg_lang, chunk in segments],
+                                                          ls=[LENGTH_SCALES.get(seg_lang, 1.0)
+                                                              for seg_lang, chunk in segments])
+        return util.AudioBuffer.concatenate([util.AudioBuffer(wav, 22050) for wav in wavs])
+
+    def close(self):
+        self.sessions.stop()
+        self.speech_executor.shutdown(wait=False, cancel_futures=True)
+        self.scheduler.stop()
+        if self.vits.text_cache is not None:
+            self.vits.text_cache.close()
+        if self.vits.frontend is not None:
+            self.vits.frontend.close()
+
+
+def create_app(args):
+    models = SpeechModels(args)
+    app = FastAPI(title='Live2D Chat speech server')
+
+    @app.on_event('shutdown')
+    def shutdown():
+        models.close()
+
+    @app.get('/health')
+    def health():
+        return {'status': 'ok', 'speaker': models.speaker, 'sessions': len(models.sessions),
+                'queue_depth': models.scheduler.queue_depth(),
+                'text_cache': models.vits.text_cache.stats() if models.vits.text_cache is not None else None,
+                'wave_cache': models.vits.wave_cache.stats() if models.vits.wave_cache is not None else None}
+
+    @app.post('/transcribe')
+    async def transcribe(file: UploadFile = File(...), language: str = 'Chinese',
+                         session_id: str = Header('default')):
+        data = await file.read()
+        try:
+            audio = util.AudioBuffer.load(io.BytesIO(data))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f'无法解析 wav: {e}')
+        text = await run_in_threadpool(models.transcribe, audio, language, session_id)
+        return {'text': text}
+
+    @app.post('/chat')
+    async def chat(request: ChatRequest, session_id: str = Header('default')):
+        def ask():
+            with models.sessions.use(session_id) as session, session.turn_lock:
+                return session.llm.ask(request.text)
+
+        reply = await run_in_threadpool(ask)
+        return {
+            'reply': reply,
+            'segments': [{'lang': lang, 'text': text} for lang, text in util.split_text_by_language(reply)]
+        }
+
+    @app.delete('/sessions/{session_id}')
+    def delete_session(session_id: str):
+        if models.sessions.remove(session_id) is None:
+            raise HTTPException(status_code=404, detail='会话不存在')
+        return {'status': 'ok'}
+
+    @app.post('/synthesize')
+    async def synthesize(request: SynthesizeRequest, session_id: str = Header('default')):
+        try:
+            speech = await run_in_threadpool(models.synthesize, request.text, request.lang, session_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return Response(content=speech.to_wav_bytes(), media_type='audio/wav')
+
+    @app.websocket('/ws/speech')
+    async def speech_ws(websocket: WebSocket, session: str = None):
+        """
+        客户端发送 {"text": "..."} 文本帧或 wav 二进制帧；服务端依次返回
+        {"type": "transcript"}（仅语音输入）、每段合成完成后的 {"type": "segment"} 加一帧 16 位 PCM、
+        以及 {"type": "done"}。新的输入会打断同一会话上一条还在进行的回复。
+        连接时可通过 ?session=... 继续已有会话，否则新建一个，会话 id 在第一条 {"type": "session"} 中返回。
+        """
+        await websocket.accept()
+        session_id = session or uuid.uuid4().hex
+        await websocket.send_json({'type': 'session', 'session_id': session_id})
+        loop = asyncio.get_running_loop()
+        outbox = asyncio.Queue()
+        sender = asyncio.create_task(_send_loop(websocket, outbox))
+        cancelled = None
+        try:
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                # 打断同一会话上一条回复，可能来自之前的连接
+                current = models.sessions.get(session_id)
+                if current.cancelled is not None:
+                    current.cancelled.set()
+                cancelled = current.cancelled = threading.Event()
+
+                def emit(item, cancelled=cancelled):
+                    loop.call_soon_threadsafe(outbox.put_nowait, (cancelled, item))
+
+                text, audio = None, None
+                try:
+                    if message.get('bytes') is not None:
+                        audio = util.AudioBuffer.load(io.BytesIO(message['bytes'])).to_mono()
+                    else:
+                        text = json.loads(message['text']).get('text')
+                        if not text:
+                            raise ValueError('缺少 text')
+                except Exception as e:
+                    emit({'type': 'error', 'message': str(e)})
+                    continue
+                # 上一轮还在进行时只替换排队的输入，不再占用新的线程
+                current.submit_turn(models.speech_executor, _run_speech, models, session_id, text, audio, cancelled,
+                                    emit)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if cancelled is not None:
+                cancelled.set()
+            sender.cancel()
+
+    return app
+
+
+def _run_speech(models, session_id, text, audio, cancelled, emit):
+    try:
+        with models.sessions.use(session_id) as session, session.turn_lock:
+            # 等待上一轮结束期间又被新的输入打断
+            if cancelled.is_set():
+                return
+            pipeline = SpeechPipeline(session.llm, models.stt(session_id), models.tts(session_id), play=False,
+                                      cancelled=cancelled,
+                                      on_segment_ready=lambda idx, chunk, speech: emit(
+                                          {'type': 'segment', 'idx': idx, 'text': chunk, 'audio': speech}),
+                                      on_transcript=lambda transcript: emit(
+                                          {'type': 'transcript', 'text': transcript}))
+            if audio is not None:
+                result = pipeline.run(audio=audio.samples.astype(np.float32), origin_rate=audio.sample_rate)
+            else:
+                result = pipeline.run(message=text)
+    except Exception as e:
+        logging.exception('speech request failed')
+        emit({'type': 'error', 'message': str(e)})
+        return
+    if result is not None:
+        reply, speech = result
+        emit({'type': 'done', 'text': reply, 'duration': speech.duration})
+
+
+async def _send_loop(websocket, outbox):
+    while True:
+        cancelled, item = await outbox.get()
+        # 已被打断的回复不再发送
+        if cancelled.is_set() and item['type'] != 'error':
+            continue
+        if item['type'] == 'segment':
+            audio = item.pop('audio')
+            item['sample_rate'] = audio.sample_rate
+            item['dtype'] = 'int16'
+            item['num_frames'] = audio.num_frames
+            await websocket.send_json(item)
+            await websocket.send_bytes(audio.to_pcm16().tobytes())
+        else:
+            await websocket.send_json(item)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='无界面的 语音识别 -> 对话 -> 语音合成 服务')
+    parser.add_argument('-c', '--config', type=str, default='config.json')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    cli_args = parser.parse_args()
+    uvicorn.run(create_app(util.load_config(cli_args.config)), host=cli_args.host, port=cli_args.port)
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Session:
+    def __init__(self, session_id, llm):
+        """
+        :param session_id: 会话 id
+        :param llm: 该会话独占的对话模型，保存自己的上下文
+        """
+        self.id = session_id
+        self.llm = llm
+        self.create_time = time.time()
+        self.last_active = self.create_time
+        # 正在处理的请求数，不为 0 时不会被回收
+        self.active = 0
+        # 同一会话的上一条回复，新输入到达时打断
+        self.cancelled = None
+        # 对话上下文不是线程安全的，同一会话的每轮对话依次进行
+        self.turn_lock = threading.Lock()
+        # 等待处理的最新一条输入，以及是否已有线程在处理这个会话的输入
+        self.pending = None
+        self.draining = False
+        self.pending_lock = threading.Lock()
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def submit_turn(self, executor, run, *args):
+        """
+        在 executor 中依次处理这个会话的输入，只保留最新的一条：前一轮还没结束时新输入替换掉排队中的输入，
+        被替换的输入不占用线程，同一会话最多占用 executor 的一个线程
+        :param run: 处理一条输入的函数，参数为 args
+        """
+        with self.pending_lock:
+            self.pending = args
+            if self.draining:
+                return
+            self.draining = True
+        executor.submit(self._drain, run)
+
+    def _drain(self, run):
+        while True:
+            with self.pending_lock:
+                args, self.pending = self.pending, None
+                if args is None:
+                    self.draining = False
+                    return
+            try:
+                run(*args)
+            except Exception:
+                logging.exception(f'session {self.id} turn failed')
+
+    @property
+    def idle_time(self):
+        return time.time() - self.last_active
+
+
+# 多会话管理：每个会话有独立的、长度有限的对话上下文，Whisper 和 ViTs 由所有会话共用
+# 示例用法
+# sessions = SessionManager(lambda: GPT(api_key, 1024, max_history=20), idle_timeout=600).start()
+# with sessions.use('user-1') as session, session.turn_lock:
+#     session.llm.ask('你好')
+# sessions.stop()
+class SessionManager:
+    def __init__(self, create_llm, idle_timeout=600, max_sessions=100, check_interval=30):
+        """
+        :param create_llm: 创建新会话的对话模型的函数
+        :param idle_timeout: 会话空闲超过该秒数后被回收
+        :param max_sessions: 最多同时保留的会话数，超出时回收最久未使用的空闲会话
+        :param check_interval: 后台检查空闲会话的间隔秒数
+        """
+        self.create_llm = create_llm
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.check_interval = check_interval
+        # 按最近使用排序，最久未使用的在前
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='SessionReaper', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get(self, session_id):
+        """
+        获取会话，不存在时创建
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.create_llm())
+                self.sessions[session_id] = session
+                logging.info(f'session created: {session_id}, sessions: {len(self.sessions)}')
+                self._evict_overflow(keep=session_id)
+            else:
+                self.sessions.move_to_end(session_id)
+            session.touch()
+            return session
+
+    @contextmanager
+    def use(self, session_id):
+        """
+        处理请求期间持有会话，避免被回收
+        """
+        session = self.get(session_id)
+        with self.lock:
+            session.active += 1
+        try:
+            yield session
+        finally:
+            with self.lock:
+                session.active -= 1
+                session.touch()
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None and session.cancelled is not None:
+            session.cancelled.set()
+        return session
+
+    def evict_idle(self):
+        """
+        回收空闲超时的会话
+        :return: 被回收的会话 id
+        """
+        with self.lock:
+            expired = [session_id for session_id, session in self.sessions.items()
+                       if session.active == 0 and session.idle_time > self.idle_timeout]
+            for session_id in expired:
+                del self.sessions[session_id]
+        if expired:
+            logging.info(f'sessions evicted: {expired}, sessions: {len(self)}')
+        return expired
+
+    def _evict_overflow(self, keep):
+        # 调用时需持有 self.lock
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            if session_id != keep and self.sessions[session_id].active == 0:
+                del self.sessions[session_id]
+                logging.info(f'session evicted: {session_id}')
+
+    def _run(self):
+        while not self.stopped.wait(self.check_interval):
+            self.evict_idle()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def __contains__(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
@@ -0,0 +1,167 @@
+import logging
+import threading
+from time import perf_counter
+
+import util
+from tracing import tracer
+from tts_module import StreamTTSPlayer
+
+# 各语言的语速
+LENGTH_SCALES = {
+    'ZH': 0.9,
+    'JA': 1.25
+}
+
+
+# 语音识别 -> 对话模型 -> 语音合成 的完整链路，不依赖 Qt，桌面端和无界面服务共用
+# 示例用法
+# pipeline = SpeechPipeline(gpt, whisper, vits, play=False,
+#                           on_segment_ready=lambda idx, text, speech: send(speech))
+# text, speech = pipeline.run(message='你好')
+class SpeechPipeline:
+    def __init__(self, ttt, stt, tts, pipelined=True, play=True, save_path=None, cancelled=None, request_id=None,
+                 on_segment_start=None, on_segment_ready=None, on_transcript=None):
+        """
+        :param pipelined: 流式接收模型回复并边合成边输出，否则等全部合成完再返回
+        :param play: 流水线模式下是否在本机播放
+        :param save_path: 不为 None 时在后台把回复的语音导出为 wav
+        :param cancelled: 取消标志 threading.Event
+        :param on_segment_start: 流水线模式下每段开始播放时的回调 (idx, 文本, AudioBuffer)
+        :param on_segment_ready: 流水线模式下每段合成完成时的回调 (idx, 文本, AudioBuffer)
+        :param on_transcript: 语音输入识别完成时的回调 (文本)
+        """
+        self.ttt = ttt
+        self.stt = stt
+        self.tts = tts
+        self.pipelined = pipelined
+        self.play = play
+        self.save_path = save_path
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self.request_id = request_id
+        self.on_segment_start = on_segment_start
+        self.on_segment_ready = on_segment_ready
+        self.on_transcript = on_transcript
+        self.start_time = None
+        self.first_audio_marked = False
+
+    def run(self, message=None, audio=None, origin_rate=44100):
+        """
+        :param message: 文字输入
+        :param audio: 录音输入，message 为空时识别后作为输入
+        :return: (回复文本, AudioBuffer)，被取消时返回 None
+        """
+        self.start_time = perf_counter()
+        self.first_audio_marked = False
+        with tracer.span('request', request_id=self.request_id, pipelined=self.pipelined) as trace_args:
+            if not message:
+                with tracer.span('stt.translate', request_id=self.request_id):
+                    message = self.stt.translate(audio, origin_rate=origin_rate, language='Chinese')[0]
+                logging.info(f'translate message: {message}')
+                if self.on_transcript is not None:
+                    self.on_transcript(message)
+            if self.cancelled.is_set():
+                logging.info('speech task cancelled')
+                trace_args['cancelled'] = True
+                return None
+
+            if self.pipelined:
+                chunks, speech = self.run_pipelined(message)
+            else:
+                chunks, speech = self.run_serial(message)
+
+            trace_args['cancelled'] = self.cancelled.is_set()
+            trace_args['audio_duration'] = speech.duration
+            if self.cancelled.is_set():
+                return None
+            if not self.pipelined:
+                self.mark_first_audio()
+            return ''.join(chunks), speech
+
+    def mark_first_audio(self):
+        # 从开始处理到第一段音频开始输出的时间
+        if self.first_audio_marked:
+            return
+        self.first_audio_marked = True
+        ttfa = perf_counter() - self.start_time
+        tracer.instant('first_audio', request_id=self.request_id, ttfa=ttfa)
+        logging.info(f'time to first audio: {ttfa:.2f}s')
+
+    def run_serial(self, message):
+        with tracer.span('llm.ask', request_id=self.request_id):
+            response = self.ttt.ask(message, cancelled=self.cancelled)
+        logging.info(response)
+
+        segments = util.split_text_by_language(response)
+        chunks = [chunk for lang, chunk in segments]
+        if self.cancelled.is_set() or not segments:
+            return chunks, util.AudioBuffer.concatenate([])
+        # 整条回复的各段按 batch 推理，每组之间检查取消，打断时不用等全部段合成完
+        with tracer.span('tts.batch', request_id=self.request_id, segments=len(segments),
+                         chars=sum(len(chunk) for chunk in chunks)) as trace_args:
+            t1 = perf_counter()
+            wavs = self.tts.generate_speech_batch([f'[{lang}]{chunk}[{lang}]' for lang, chunk in segments],
+                                                  ls=[LENGTH_SCALES[lang] for lang, chunk in segments],
+                                                  cancelled=self.cancelled)
+            segments = [util.AudioBuffer(wav, 22050) for wav in wavs]
+            audio_duration = sum(segment.duration for segment in segments)
+            trace_args['audio_duration'] = audio_duration
+            trace_args['rtf'] = (perf_counter() - t1) / audio_duration if audio_duration else 0
+
+        speech = util.AudioBuffer.concatenate(segments)
+        if self.save_path is not None:
+            speech.save_async(self.save_path)
+        return chunks, speech
+
+    def run_pipelined(self, message):
+        """
+        流式接收模型回复，每段语言标签闭合后立即送去合成，第一段合成完就开始输出，
+        模型生成、语音合成和播放三者重叠进行
+        """
+        chunks = []
+
+        def on_segment_start(idx, chunk, speech):
+            self.mark_first_audio()
+            if self.on_segment_start is not None:
+                self.on_segment_start(idx, chunks[idx], speech)
+
+        def on_segment_ready(idx, chunk, speech):
+            if not self.play:
+                self.mark_first_audio()
+            if self.on_segment_ready is not None:
+                self.on_segment_ready(idx, chunks[idx], speech)
+
+        player = StreamTTSPlayer(self.tts, play=self.play, on_segment_start=on_segment_start,
+                                 on_segment_ready=on_segment_ready, cancelled=self.cancelled,
+                                 trace_args={'request_id': self.request_id})
+        player.start(self.save_path)
+
+        def put_chunks(segments):
+            for lang, chunk in segments:
+                chunks.append(chunk)
+                player.put_chunk(f'[{lang}]{chunk}[{lang}]', LENGTH_SCALES[lang])
+
+        parser = util.LanguageSegmentParser()
+        response = []
+        try:
+            with tracer.span('llm.stream', request_id=self.request_id) as trace_args:
+                t1 = perf_counter()
+                for token in self.ttt.ask_stream(message, cancelled=self.cancelled):
+                    if not response:
+                        trace_args['first_token'] = perf_counter() - t1
+                    response.append(token)
+                    put_chunks(parser.feed(token))
+                if not self.cancelled.is_set():
+                    put_chunks(parser.close())
+                trace_args['segments'] = len(chunks)
+        except BaseException:
+            # 模型请求失败时停止已送入的段并等待生成和播放线程退出，再把异常交给调用方
+            self.cancelled.set()
+            player.finish()
+            player.join()
+            raise
+        player.finish()
+        logging.info(''.join(response))
+
+        # 等待播放结束，避免与下一次请求的播放重叠
+        speech = player.join()
+        return chunks, speech
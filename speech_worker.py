@@ -0,0 +1,264 @@
+import collections
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from tracing import tracer
+
+_request_ids = itertools.count(1)
+
+
+class SpeechRequest:
+    def __init__(self, message=None, audio=None, priority=0):
+        """
+        :param message: 文字输入
+        :param audio: 录音输入，message 为空时使用
+        :param priority: 数字越小越优先
+        """
+        self.id = next(_request_ids)
+        self.message = message
+        self.audio = audio
+        self.priority = priority
+        # 被新请求取代或手动取消时置位，处理过程中应在各阶段之间检查
+        self.cancelled = threading.Event()
+        self.submit_time = None
+        self.start_time = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    @property
+    def wait_time(self):
+        if self.submit_time is None:
+            return 0
+        end = self.start_time if self.start_time is not None else time.perf_counter()
+        return end - self.submit_time
+
+
+# 常驻的语音请求处理线程，UI 线程只负责投递请求，不再为每条消息创建线程
+# 示例用法
+# worker = SpeechWorker(handler)
+# worker.start()
+# worker.submit(SpeechRequest('你好'))
+# worker.stop()
+class SpeechWorker:
+    def __init__(self, handler, num_workers=1, cancel_stale=True):
+        """
+        :param handler: 在工作线程中处理请求的函数 handler(request)
+        :param num_workers: 工作线程数，模型只有一份时应为 1
+        :param cancel_stale: 新请求到达时取消优先级不高于它的排队中和处理中的请求
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.cancel_stale = cancel_stale
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.active = set()
+        self.threads = []
+        self.stats = {
+            'submitted': 0,
+            'started': 0,
+            'completed': 0,
+            'cancelled': 0,
+            'failed': 0,
+            'last_wait': 0.0,
+            'max_wait': 0.0,
+            'total_wait': 0.0
+        }
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'SpeechWorker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, request):
+        with self.lock:
+            if self.cancel_stale:
+                for stale in self.pending | self.active:
+                    if stale.priority >= request.priority:
+                        stale.cancel()
+            request.submit_time = time.perf_counter()
+            self.pending.add(request)
+            self.stats['submitted'] += 1
+        self.queue.put((request.priority, next(self.counter), request))
+        logging.info(f'speech request queued, queue depth: {self.queue_depth()}')
+        return request
+
+    def cancel_all(self):
+        with self.lock:
+            for request in self.pending | self.active:
+                request.cancel()
+
+    def queue_depth(self):
+        """
+        排队中且未被取消的请求数
+        """
+        with self.lock:
+            return sum(1 for request in self.pending if not request.is_cancelled())
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['avg_wait'] = stats['total_wait'] / stats['started'] if stats['started'] else 0.0
+            stats['queue_depth'] = sum(1 for request in self.pending if not request.is_cancelled())
+            stats['active'] = len(self.active)
+        return stats
+
+    def stop(self):
+        self.cancel_all()
+        for _ in self.threads:
+            self.queue.put((float('-inf'), next(self.counter), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def _run(self):
+        while True:
+            _, _, request = self.queue.get()
+            if request is None:
+                break
+            with self.lock:
+                self.pending.discard(request)
+                if request.is_cancelled():
+                    self.stats['cancelled'] += 1
+                    continue
+                request.start_time = time.perf_counter()
+                wait = request.wait_time
+                self.stats['started'] += 1
+                self.stats['last_wait'] = wait
+                self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+                self.stats['total_wait'] += wait
+                self.active.add(request)
+                depth = sum(1 for r in self.pending if not r.is_cancelled())
+            tracer.record('queue.wait', request.submit_time, request.start_time, request_id=request.id,
+                          queue_depth=depth)
+            logging.info(f'speech request started after waiting {wait:.3f}s, queue depth: {depth}')
+            try:
+                self.handler(request)
+            except Exception:
+                logging.exception('speech request failed')
+                with self.lock:
+                    self.stats['failed'] += 1
+            else:
+                with self.lock:
+                    self.stats['cancelled' if request.is_cancelled() else 'completed'] += 1
+            finally:
+                with self.lock:
+                    self.active.discard(request)
+
+
+# 多个会话共用模型时的公平调度：每个会话一个任务队列，工作线程按会话轮流取任务，
+# 某个会话一次提交很多段也不会让其他会话一直等待
+# 示例用法
+# scheduler = FairScheduler().start()
+# tts = scheduler.bind(session_id, vits)
+# tts.generate_speech('[ZH]你好[ZH]')  # 在调度线程中执行并等待结果
+class FairScheduler:
+    def __init__(self, num_workers=1):
+        """
+        :param num_workers: 同时执行的任务数，模型只有一份时应为 1
+        """
+        self.num_workers = num_workers
+        self.queues = collections.OrderedDict()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'FairScheduler-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        :param key: 公平调度的单位，一般是会话 id
+        :return: concurrent.futures.Future
+        """
+        future = Future()
+        with self.condition:
+            self.queues.setdefault(key, collections.deque()).append((time.perf_counter(), future, fn, args, kwargs))
+            self.condition.notify()
+        return future
+
+    def call(self, key, fn, *args, **kwargs):
+        return self.submit(key, fn, *args, **kwargs).result()
+
+    def bind(self, key, model):
+        return ScheduledModel(self, key, model)
+
+    def queue_depth(self, key=None):
+        with self.condition:
+            if key is not None:
+                return len(self.queues.get(key, ()))
+            return sum(len(q) for q in self.queues.values())
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+
+    def _next(self):
+        # 取队首会话的一个任务，然后把该会话移到队尾
+        key, jobs = next(iter(self.queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self.queues.move_to_end(key)
+        else:
+            del self.queues[key]
+        return key, job
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queues:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                key, (submit_time, future, fn, args, kwargs) = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            tracer.record('scheduler.wait', submit_time, time.perf_counter(), session=key)
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class ScheduledModel:
+    """
+    把模型的方法调用转交给 FairScheduler 执行，对调用方透明
+    """
+
+    def __init__(self, scheduler, key, model):
+        self.scheduler = scheduler
+        self.key = key
+        self.model = model
+
+    # 不占用模型的方法直接调用，不排队
+    passthrough = ('prefetch_text',)
+
+    def __getattr__(self, name):
+        attr = getattr(self.model, name)
+        if not callable(attr) or name in self.passthrough:
+            return attr
+
+        def scheduled(*args, **kwargs):
+            return self.scheduler.call(self.key, attr, *args, **kwargs)
+
+        return scheduled
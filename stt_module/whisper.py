@@ -1,3 +1,5 @@
+import threading
+
 from tqdm import tqdm
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
 import torch
@@ -23,6 +25,8 @@ class Whisper:
         self.device = torch.device(device)
         # Load Whisper processor for feature extraction and tokenization
         self.processor = WhisperProcessor.from_pretrained(model_path)
+        # 多个线程共用同一个模型时串行推理
+        self.lock = threading.Lock()
 
     def translate_audio_file(self, audio_paths, max_batch=10, language=None):
         # Path to your .wav file
@@ -47,7 +51,7 @@ class Whisper:
                 self.device)
 
             # Perform translation
-            with torch.no_grad():
+            with torch.no_grad(), self.lock:
                 generated_ids = self.model.generate(input_features, language=language)
                 translated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
                 for text in translated_text:
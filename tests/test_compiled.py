@@ -0,0 +1,85 @@
+import logging
+import unittest
+
+import torch
+
+from tts_module.vits.compiled import CompiledSynthesizer
+from tts_module.vits.models import SynthesizerTrn
+
+
+class _RecompileHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if 'Recompiling' in message:
+            self.messages.append(message)
+
+
+def _tiny_synthesizer(n_speakers=0):
+    torch.manual_seed(0)
+    net = SynthesizerTrn(40, 513, 32, inter_channels=16, hidden_channels=16, filter_channels=32, n_heads=2,
+                         n_layers=1, kernel_size=3, p_dropout=0.1, resblock='1', resblock_kernel_sizes=[3],
+                         resblock_dilation_sizes=[[1, 3, 5]], upsample_rates=[4, 4], upsample_initial_channel=32,
+                         upsample_kernel_sizes=[8, 8], n_speakers=n_speakers, gin_channels=8 if n_speakers else 0)
+    return net.prepare_for_inference().eval()
+
+
+# torch._dynamo 有自己的 handler 且不向上传递，两处都要挂上
+_LOGGERS = ('torch', 'torch._dynamo')
+
+
+class CompiledWarmupTest(unittest.TestCase):
+    def setUp(self):
+        torch._dynamo.reset()
+        torch._logging.set_logs(recompiles=True)
+        self.handler = _RecompileHandler()
+        for name in _LOGGERS:
+            logging.getLogger(name).addHandler(self.handler)
+
+    def tearDown(self):
+        for name in _LOGGERS:
+            logging.getLogger(name).removeHandler(self.handler)
+        torch._logging.set_logs()
+        torch._dynamo.reset()
+
+    def check_no_recompile_after_warmup(self, n_speakers):
+        net = CompiledSynthesizer(_tiny_synthesizer(n_speakers), text_buckets=(32, 64)).warmup()
+        graphs = torch._dynamo.utils.counters['stats']['unique_graphs']
+        self.handler.messages.clear()
+
+        def sid(batch):
+            return torch.LongTensor([0] * batch) if n_speakers else None
+
+        with torch.no_grad():
+            # generate_speech：batch 为 1，各种长度和语速
+            for length, length_scale in ((5, 1.0), (30, 0.8), (50, 1.2)):
+                x = torch.randint(1, 40, (1, length))
+                net.infer(x, torch.LongTensor([length]), sid(1), noise_scale=0.6, noise_scale_w=0.668,
+                          length_scale=length_scale)
+            # generate_speech_batch：不同的 batch 大小，每条一个语速
+            for batch, length in ((2, 20), (3, 40), (5, 64)):
+                x = torch.randint(1, 40, (batch, length))
+                x_lengths = torch.randint(1, length + 1, (batch,))
+                x_lengths[0] = length
+                net.infer(x, x_lengths, sid(batch), noise_scale=0.6, noise_scale_w=0.668,
+                          length_scale=torch.full((batch,), 0.95))
+            # generate_speech_stream
+            x = torch.randint(1, 40, (1, 45))
+            for _ in net.infer_stream(x, torch.LongTensor([45]), sid(1), noise_scale=0.6, noise_scale_w=0.668):
+                pass
+
+        self.assertEqual(self.handler.messages, [])
+        self.assertEqual(torch._dynamo.utils.counters['stats']['unique_graphs'], graphs)
+
+    def test_single_speaker(self):
+        self.check_no_recompile_after_warmup(0)
+
+    def test_multi_speaker(self):
+        self.check_no_recompile_after_warmup(4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import random
+import unittest
+
+from tts_module.vits.text import SymbolEncoder, get_encoder
+from tts_module.vits.text.symbols import symbols
+
+
+def _reference_ids(clean_text):
+    # text_to_sequence 改用 SymbolEncoder 之前的逐字查表，不在符号表中的字符直接跳过
+    symbol_to_id = {s: i for i, s in enumerate(symbols)}
+    return [symbol_to_id[c] for c in clean_text if c in symbol_to_id]
+
+
+class SymbolEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = get_encoder(symbols)
+        # 符号、表外的汉字和假名、emoji 等 BMP 之外的字符、单独的代理码位
+        self.alphabet = list(symbols) + ['你', 'ア', '😀', '\U00020000', '\ud800', '\udfff', '\x00']
+        rng = random.Random(0)
+        self.texts = [''.join(rng.choice(self.alphabet) for _ in range(rng.randint(0, 40))) for _ in range(200)]
+        self.texts += ['', '\ud83d', 'a\udc00b', '😀']
+
+    def test_ids(self):
+        for text in self.texts:
+            self.assertEqual(self.encoder.ids(text).tolist(), _reference_ids(text), repr(text))
+
+    def test_encode_add_blank(self):
+        for text in self.texts:
+            expected = [0]
+            for i in _reference_ids(text):
+                expected += [i, 0]
+            self.assertEqual(self.encoder.encode(text, add_blank=True).tolist(), expected, repr(text))
+
+    def test_encode_batch(self):
+        for add_blank in (False, True):
+            ids, lengths = self.encoder.encode_batch(self.texts, add_blank)
+            for row, text in enumerate(self.texts):
+                expected = self.encoder.encode(text, add_blank).tolist()
+                self.assertEqual(lengths[row].item(), len(expected), repr(text))
+                self.assertEqual(ids[row, :len(expected)].tolist(), expected, repr(text))
+                self.assertFalse(ids[row, len(expected):].any(), repr(text))
+
+    def test_cached_per_symbol_table(self):
+        self.assertIs(get_encoder(list(symbols)), self.encoder)
+        self.assertIsInstance(self.encoder, SymbolEncoder)
+
+
+if __name__ == '__main__':
+    unittest.main()
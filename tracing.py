@@ -0,0 +1,165 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# 语音链路各阶段的耗时记录，可导出为 json lines 和 Chrome trace viewer (chrome://tracing) 格式
+# 示例用法
+# from tracing import tracer
+# tracer.open('trace.jsonl')
+# with tracer.span('tts.segment', request_id=1, idx=0) as args:
+#     ...
+#     args['rtf'] = 0.3
+# tracer.export_chrome('trace.json')
+class Tracer:
+    def __init__(self, max_events=100000):
+        """
+        :param max_events: 内存中最多保留的事件数，超出后丢弃最早的
+        """
+        self.origin = time.perf_counter()
+        self.events = collections.deque(maxlen=max_events)
+        self.lock = threading.Lock()
+        self.file = None
+        self.enabled = True
+
+    def open(self, path):
+        """
+        之后的每个事件同时追加写入 json lines 文件
+        """
+        self.close()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def record(self, name, start, end, **args):
+        """
+        记录一个已经结束的阶段
+        :param start: time.perf_counter() 时间
+        :param end: time.perf_counter() 时间
+        """
+        self._add({
+            'name': name,
+            'start': start - self.origin,
+            'duration': end - start,
+            'thread': threading.current_thread().name,
+            'thread_id': threading.get_ident(),
+            'args': args
+        })
+
+    def instant(self, name, **args):
+        """
+        记录一个时间点，例如首段音频开始播放
+        """
+        self._add({
+            'name': name,
+            'start': time.perf_counter() - self.origin,
+            'duration': None,
+            'thread': threading.current_thread().name,
+            'thread_id': threading.get_ident(),
+            'args': args
+        })
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        记录 with 块的耗时，块内可以往返回的 dict 中补充参数
+        """
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.perf_counter(), **args)
+
+    def _add(self, event):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.events.append(event)
+            if self.file is not None:
+                self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+                self.file.flush()
+
+    def get_events(self, name=None):
+        with self.lock:
+            return [e for e in self.events if name is None or e['name'] == name]
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+
+    def summary(self):
+        """
+        按阶段统计耗时 {name: {'count', 'mean', 'p50', 'p95', 'max'}}，单位秒
+        """
+        durations = collections.defaultdict(list)
+        for event in self.get_events():
+            if event['duration'] is not None:
+                durations[event['name']].append(event['duration'])
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = {
+                'count': len(values),
+                'mean': sum(values) / len(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'max': values[-1]
+            }
+        return result
+
+    def export_jsonl(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for event in self.get_events():
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def export_chrome(self, path):
+        """
+        导出为 Chrome trace event 格式，可在 chrome://tracing 或 Perfetto 中打开
+        """
+        pid = os.getpid()
+        trace_events = []
+        thread_names = {}
+        for event in self.get_events():
+            thread_names[event['thread_id']] = event['thread']
+            chrome_event = {
+                'name': event['name'],
+                'cat': event['name'].split('.')[0],
+                'ts': event['start'] * 1e6,
+                'pid': pid,
+                'tid': event['thread_id'],
+                'args': event['args']
+            }
+            if event['duration'] is None:
+                chrome_event['ph'] = 'i'
+                chrome_event['s'] = 't'
+            else:
+                chrome_event['ph'] = 'X'
+                chrome_event['dur'] = event['duration'] * 1e6
+            trace_events.append(chrome_event)
+        for tid, name in thread_names.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+# 全局共享的 tracer
+tracer = Tracer()
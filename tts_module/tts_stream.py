@@ -2,10 +2,8 @@ import threading
 import queue
 from time import perf_counter
 
-import numpy
-import torchaudio
-import torch
-import sounddevice as sd
+from tracing import tracer
+from util import AudioBuffer, play_audio, stop_audio, wait_audio
 
 
 # 示例用法
@@ -13,32 +11,80 @@ import sounddevice as sd
 # player = StreamTTSPlayer(tts)
 # long_text = "这是一个很长的文本，需要被分段生成和播放的例子......"
 # player.text_to_speech_streaming(long_text, chunk_size=50)
+# player.join()
 # 如果需要手动停止，可以调用 player.stop()
 class StreamTTSPlayer:
-    def __init__(self, tts):
+    def __init__(self, tts, play=True, max_queue=2, on_segment_start=None, cancelled=None, trace_args=None,
+                 on_segment_ready=None):
+        """
+        :param tts: 提供 generate_speech 的 TTS 对象
+        :param play: 是否边生成边播放，为 False 时只生成并保存
+        :param max_queue: 生成线程与播放线程之间最多缓存的段数，生成超前太多时会阻塞
+        :param on_segment_start: 每段开始播放时的回调 (idx, chunk, AudioBuffer)
+        :param cancelled: 取消标志 threading.Event，置位后不再生成新的段并立即停止播放
+        :param trace_args: 附加到每个 trace 事件上的参数，例如 request_id
+        :param on_segment_ready: 每段生成完成时在生成线程中的回调 (idx, chunk, AudioBuffer)，不播放时用于转发音频
+        """
         self.tts = tts
-        self.audio_queue = queue.Queue()
+        self.play = play
+        self.audio_queue = queue.Queue(maxsize=max_queue)
         self.sample_rate = 22050
         self.playing = threading.Event()
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self.text_queue = queue.Queue()
         self.generate_thread = None
         self.play_thread = None
-        self.audio_data = numpy.array([])
-
-    def text_to_speech_streaming_by_chunk(self, chunks, save_path, **kwargs):
-        print(f"Total chunks: {len(chunks)}")
+        self.segments = []
+        self.on_segment_start = on_segment_start
+        self.on_segment_ready = on_segment_ready
+        self.trace_args = trace_args or {}
+        # 生成线程中的异常，join 时重新抛出
+        self.error = None
 
+    def start(self, save_path=None):
+        """
+        启动生成和播放线程，之后通过 put_chunk 逐段送入文本，最后调用 finish
+        :param save_path: 不为 None 时全部生成后在后台导出 wav
+        """
         # 初始化播放状态
         self.playing.set()
+        self.segments = []
+        self.text_queue = queue.Queue()
+        self.error = None
 
-        # 启动播放线程
-        # 不进行streaming播放了
-        # self.play_thread = threading.Thread(target=self._play_audio)
-        # self.play_thread.start()
+        # 启动播放线程，第一段生成完就开始播放，后面的段在后台继续生成
+        if self.play:
+            self.play_thread = threading.Thread(target=self._play_audio, daemon=True)
+            self.play_thread.start()
 
         # 启动生成线程
-        self.generate_thread = threading.Thread(target=self._generate_audio, args=(chunks, save_path), kwargs=kwargs)
+        self.generate_thread = threading.Thread(target=self._generate_audio, args=(save_path,), daemon=True)
         self.generate_thread.start()
 
+    def put_chunk(self, chunk, length_scale=1.0):
+        # tts 支持时立即开始处理文本，前一段还在合成时这一段的文本前端已经完成
+        prefetch = getattr(self.tts, 'prefetch_text', None)
+        if prefetch is not None:
+            prefetch(chunk)
+        self.text_queue.put((chunk, length_scale))
+
+    def finish(self):
+        """
+        所有文本都已送入
+        """
+        self.text_queue.put(None)
+
+    def text_to_speech_streaming_by_chunk(self, chunks, save_path, **kwargs):
+        print(f"Total chunks: {len(chunks)}")
+        chunk_speed = kwargs.get('chunk_ls', 1.0)
+        if not (isinstance(chunk_speed, list) or isinstance(chunk_speed, tuple)):
+            chunk_speed = [chunk_speed] * len(chunks)
+
+        self.start(save_path)
+        for chunk, length_scale in zip(chunks, chunk_speed):
+            self.put_chunk(chunk, length_scale)
+        self.finish()
+
     def text_to_speech_streaming(self, text, save_path, chunk_size=100, **kwargs):
         """
         启动生成和播放的线程
@@ -47,47 +93,119 @@ class StreamTTSPlayer:
         chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
         self.text_to_speech_streaming_by_chunk(chunks, save_path, **kwargs)
 
-    def _generate_audio(self, chunks, save_path, **kwargs):
+    def _generate_audio(self, save_path):
         """
         按段生成语音并放入队列
         """
-        chunk_speed = kwargs.get('chunk_ls', 1.0)
-        if not (isinstance(chunk_speed, list) or isinstance(chunk_speed, tuple)):
-            chunk_speed = [1.0] * len(chunks)
-        for idx, (chunk, length_scale) in enumerate(zip(chunks, chunk_speed)):
-            print(f"Generating chunk {idx + 1}/{len(chunks)}: {chunk} with length scale", length_scale)
-            t1 = perf_counter()
-            speech = self.tts.generate_speech(chunk, ls=length_scale)  # 生成语音
-            # 保存
-            self.audio_data = numpy.concatenate([self.audio_data, speech], axis=0)
-            t2 = perf_counter()
-            print(f"Generate speech for chunk {idx + 1} took {(t2 - t1):.2f}s")
-            self.audio_queue.put(speech)  # 放入队列
-        self.audio_queue.put(None)  # 生成结束标志
+        try:
+            idx = 0
+            while self._running():
+                try:
+                    item = self.text_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is None:
+                    break
+                chunk, length_scale = item
+                if self.cancelled.is_set():
+                    break
+                print(f"Generating chunk {idx + 1}: {chunk} with length scale", length_scale)
+                t1 = perf_counter()
+                # 生成语音
+                speech = AudioBuffer(self.tts.generate_speech(chunk, ls=length_scale), self.sample_rate)
+                self.segments.append(speech)
+                t2 = perf_counter()
+                # 实时率 = 合成耗时 / 音频时长，小于 1 才能边生成边播放不断档
+                rtf = (t2 - t1) / speech.duration if speech.duration else 0
+                tracer.record('tts.segment', t1, t2, idx=idx, chars=len(chunk), audio_duration=speech.duration,
+                              rtf=rtf, **self.trace_args)
+                print(f"Generate speech for chunk {idx + 1} took {(t2 - t1):.2f}s")
+                if self.on_segment_ready is not None:
+                    self.on_segment_ready(idx, chunk, speech)
+                if self.play:
+                    self._put((idx, chunk, speech, t2))  # 放入队列，队列满时等待播放线程
+                idx += 1
+        except Exception as e:
+            # 合成失败时也要放入结束标志，否则播放线程和 join 会一直等待
+            self.error = e
+        finally:
+            if self.play:
+                self._put(None)  # 生成结束标志
+        if self.error is not None:
+            print(f"Generation failed: {self.error}")
+            return
+        if self.cancelled.is_set():
+            print("Generation cancelled.")
+            return
         print("All chunks have been generated.")
         # 保存文件
-        torchaudio.save(save_path, torch.from_numpy(self.audio_data).unsqueeze(dim=0),
-                        sample_rate=22050, encoding='PCM_S')
+        if save_path is not None and self.segments:
+            self.get_audio().save_async(save_path)
+
+    def get_audio(self):
+        """
+        已生成的全部语音
+        """
+        return AudioBuffer.concatenate(self.segments, self.sample_rate)
+
+    def _running(self):
+        return self.playing.is_set() and not self.cancelled.is_set()
+
+    def _put(self, item):
+        # 队列满时定期检查是否已被停止，避免播放线程退出后生成线程一直阻塞
+        while self._running():
+            try:
+                self.audio_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
 
     def _play_audio(self):
         """
         从队列中获取音频并播放
         """
-        while self.playing.is_set():
-            speech = self.audio_queue.get()
-            if speech is None:  # 遇到结束标志，停止播放
+        while self._running():
+            try:
+                item = self.audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:  # 遇到结束标志，停止播放
+                break
+            idx, chunk, speech, ready_time = item
+            # 生成完成到开始播放之间的等待
+            tracer.record('playback.queue_wait', ready_time, perf_counter(), idx=idx, **self.trace_args)
+            tracer.instant('playback.start', idx=idx, **self.trace_args)
+            if self.on_segment_start is not None:
+                self.on_segment_start(idx, chunk, speech)
+            play_audio(speech)
+            # 播放期间等待取消，被取消时立即停止输出
+            if self.cancelled.wait(speech.duration):
+                stop_audio()
                 break
-            # print("Playing audio chunk...")
-            # sd.play(speech, self.sample_rate)
-            # sd.wait()  # 等待当前段播放完成
+            wait_audio()  # 等待当前段播放完成
         print("Playback finished.")
         self.playing.clear()
 
+    def join(self):
+        """
+        等待生成和播放全部完成
+        """
+        if self.generate_thread is not None:
+            self.generate_thread.join()
+        if self.play_thread is not None:
+            self.play_thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.get_audio()
+
     def stop(self):
         """
         停止生成和播放
         """
+        self.cancelled.set()
         self.playing.clear()
+        if self.play:
+            stop_audio()
         if self.generate_thread and self.generate_thread.is_alive():
             self.generate_thread.join()
         if self.play_thread and self.play_thread.is_alive():
@@ -0,0 +1,109 @@
+import bisect
+import logging
+import time
+
+import torch
+from torch.nn import functional as F
+
+from tts_module.vits.models import SynthesizerTrn
+
+# 音素序列补齐到的长度，超过最大值时不编译直接运行
+DEFAULT_TEXT_BUCKETS = (32, 64, 128, 256)
+# 预热时编译的 batch 大小，batch 为 1 单独特化，大于 1 的共用一份动态 batch 的图
+WARMUP_BATCH_SIZES = (1, 2)
+
+
+def _raise_recompile_limit(limit):
+    # torch 2.5 中叫 cache_size_limit，之后的版本改名为 recompile_limit
+    config = torch._dynamo.config
+    name = 'recompile_limit' if hasattr(config, 'recompile_limit') else 'cache_size_limit'
+    if getattr(config, name) < limit:
+        setattr(config, name, limit)
+
+
+class CompiledSynthesizer:
+    """
+    用 torch.compile 编译 SynthesizerTrn 的推理，接口与 SynthesizerTrn 的 infer / infer_stream 相同
+    文本编码器：音素序列补齐到几个固定长度，每个长度编译一份静态形状的图并缓存，padding 部分被 x_mask 屏蔽，不影响结果；
+    batch 维按动态形状编译，每个长度只有 batch 为 1 和大于 1 两份图，不会因为 generate_speech_batch 的各种 batch 大小反复重新编译
+    flow 和声码器：帧数由预测的时长决定，补齐会按比例增加声码器的计算量，因此按动态帧数编译
+    随机时长预测器中的样条变换依赖数据决定形状，无法编译，仍然直接运行
+    """
+
+    def __init__(self, net, text_buckets=DEFAULT_TEXT_BUCKETS):
+        """
+        :param net: 已调用 prepare_for_inference 的 SynthesizerTrn
+        :param text_buckets: 音素序列补齐到的长度
+        """
+        self.net = net
+        self.text_buckets = sorted(text_buckets)
+        # 每个长度每种 batch 一份图，超过 dynamo 的重新编译上限时文本编码器会退回 eager 执行
+        _raise_recompile_limit(len(self.text_buckets) * len(WARMUP_BATCH_SIZES))
+        # 文本编码器每个长度对应一份编译结果，由 dynamo 按输入形状缓存
+        self.compiled_modules = {
+            'enc_p': torch.compile(net.enc_p, dynamic=False),
+            'flow': torch.compile(net.flow, dynamic=True),
+            'dec': torch.compile(net.dec, dynamic=True)
+        }
+
+    def __getattr__(self, name):
+        # 参数、精度策略、state_dict 等都使用原模型的
+        return getattr(self.net, name)
+
+    def run_module(self, name, *args, **kwargs):
+        if name in self.compiled_modules and name not in self.net.bf16_modules:
+            return self.compiled_modules[name](*args, **kwargs)
+        return self.net.run_module(name, *args, **kwargs)
+
+    def infer_text(self, x, x_lengths, sid=None, noise_scale_w=1., noise=None):
+        length = x.size(1)
+        i = bisect.bisect_left(self.text_buckets, length)
+        if i == len(self.text_buckets):
+            # 超出最长的长度时不编译，避免为新的形状重新编译
+            return self.net.infer_text(x, x_lengths, sid, noise_scale_w, noise)
+        bucket = self.text_buckets[i]
+        x = F.pad(x, (0, bucket - length))
+        if noise is not None:
+            noise = F.pad(noise, (0, bucket - length))
+        if x.size(0) > 1:
+            # batch 大于 1 时共用一份动态 batch 的图
+            torch._dynamo.mark_dynamic(x, 0)
+            torch._dynamo.mark_dynamic(x_lengths, 0)
+        m_p, logs_p, x_mask, logw, g = SynthesizerTrn.infer_text(self, x, x_lengths, sid, noise_scale_w, noise)
+        return m_p[:, :, :length], logs_p[:, :, :length], x_mask[:, :, :length], logw[:, :, :length], g
+
+    def warmup(self, sid=None, frames=(64, 256)):
+        """
+        加载时调用，按推理时的调用方式完整运行 infer 和 infer_stream，编译之后会用到的全部图：
+        每个长度、每种 batch 的文本编码器，每种 batch 下帧数在 frames 附近的 flow 和声码器，以及流式解码的窗口
+        :param frames: flow 和声码器编译时的大致帧数，卷积的实现会随帧数切换，两个值分别覆盖短句和长句
+        """
+        t1 = time.perf_counter()
+        device = next(self.net.parameters()).device
+
+        def inputs(batch, length):
+            x = torch.randint(1, self.net.n_vocab, (batch, length), device=device)
+            x_lengths = torch.LongTensor([length] * batch).to(device)
+            sids = torch.LongTensor([sid if sid is not None else 0] * batch).to(device) \
+                if self.net.n_speakers > 0 else None
+            return x, x_lengths, sids
+
+        with torch.no_grad():
+            for batch in WARMUP_BATCH_SIZES:
+                for bucket in self.text_buckets:
+                    self.infer(*inputs(batch, bucket))
+                # 帧数由预测的时长决定，按语速 1 时的帧数换算语速，使帧数落在 frames 附近
+                x, x_lengths, sids = inputs(batch, self.text_buckets[0])
+                base = self.infer(x, x_lengths, sids)[2].size(2)
+                for length in frames:
+                    self.infer(x, x_lengths, sids, length_scale=length / base)
+            # 流式合成只支持 batch 为 1，声码器按窗口解码
+            for _ in self.infer_stream(*inputs(1, self.text_buckets[0])):
+                pass
+        logging.info(f'compiled vits inference in {time.perf_counter() - t1:.2f}s')
+        return self
+
+    # 推理流程与 PyTorch 模型相同
+    infer = SynthesizerTrn.infer
+    infer_latent = SynthesizerTrn.infer_latent
+    infer_stream = SynthesizerTrn.infer_stream
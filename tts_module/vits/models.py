@@ -46,7 +46,14 @@ class StochasticDurationPredictor(nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, filter_channels, 1)
 
-    def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0):
+    def remove_posterior(self):
+        # 后验部分只在训练时 (reverse=False) 使用
+        del self.post_pre, self.post_proj, self.post_convs, self.post_flows
+
+    def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0, noise=None):
+        """
+        :param noise: reverse 时使用的标准正态噪声 [b, 2, t]，为 None 时随机生成，导出 onnx 时作为输入传入
+        """
         x = torch.detach(x)
         x = self.pre(x)
         if g is not None:
@@ -86,7 +93,9 @@ class StochasticDurationPredictor(nn.Module):
         else:
             flows = list(reversed(self.flows))
             flows = flows[:-2] + [flows[-1]]  # remove a useless vflow
-            z = torch.randn(x.size(0), 2, x.size(2)).to(device=x.device, dtype=x.dtype) * noise_scale
+            if noise is None:
+                noise = torch.randn(x.size(0), 2, x.size(2))
+            z = noise.to(device=x.device, dtype=x.dtype) * noise_scale
             for flow in flows:
                 z = flow(z, x_mask, g=x, reverse=reverse)
             z0, z1 = torch.split(z, [1, 1], 1)
@@ -209,6 +218,11 @@ class ResidualCouplingBlock(nn.Module):
                 x = flow(x, x_mask, g=g, reverse=reverse)
         return x
 
+    def remove_weight_norm(self):
+        for flow in self.flows:
+            if isinstance(flow, modules.ResidualCouplingLayer):
+                flow.remove_weight_norm()
+
 
 class PosteriorEncoder(nn.Module):
     def __init__(self,
@@ -458,6 +472,9 @@ class SynthesizerTrn(nn.Module):
 
         if n_speakers > 1:
             self.emb_g = nn.Embedding(n_speakers, gin_channels)
+        self.inference_only = False
+        # 在 bfloat16 autocast 下运行的子模块名
+        self.bf16_modules = frozenset()
 
     def forward(self, x, x_lengths, y, y_lengths, sid=None):
 
@@ -500,17 +517,60 @@ class SynthesizerTrn(nn.Module):
         o = self.dec(z_slice, g=g)
         return o, l_length, attn, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
+    def prepare_for_inference(self):
+        """
+        只用于推理时调用：把 weight norm 合并为普通权重，删除 infer 不会用到的模块（后验编码器、
+        随机时长预测器的后验部分），之后不能再训练
+        """
+        if self.inference_only:
+            return self
+        self.dec.remove_weight_norm()
+        self.flow.remove_weight_norm()
+        del self.enc_q
+        if self.use_sdp:
+            self.dp.remove_posterior()
+        self.inference_only = True
+        return self.eval()
+
+    def set_precision_policy(self, bf16_modules):
+        """
+        :param bf16_modules: 推理时在 bfloat16 autocast 下运行的子模块，可选 enc_p、dp、flow、dec，
+                             为空时全部使用 fp32。dp 的样条变换和 flow 对精度敏感，一般只选 enc_p 和 dec
+        """
+        unknown = set(bf16_modules) - {'enc_p', 'dp', 'flow', 'dec'}
+        if unknown:
+            raise ValueError(f'unknown modules in precision policy: {sorted(unknown)}')
+        self.bf16_modules = frozenset(bf16_modules)
+        return self
+
+    def run_module(self, name, *args, **kwargs):
+        """
+        按精度策略运行子模块，输出转回 fp32，模块之间的对齐、采样等计算仍使用 fp32
+        """
+        module = getattr(self, name)
+        if name not in self.bf16_modules:
+            return module(*args, **kwargs)
+        device_type = next(module.parameters()).device.type
+        with torch.autocast(device_type, dtype=torch.bfloat16):
+            outputs = module(*args, **kwargs)
+        if isinstance(outputs, tuple):
+            return tuple(o.float() for o in outputs)
+        return outputs.float()
+
     def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_len=None):
-        x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
-        if self.n_speakers > 0:
-            g = self.emb_g(sid).unsqueeze(-1)  # [b, h, 1]
-        else:
-            g = None
+        z, y_mask, g, (attn, z_p, m_p, logs_p) = self.infer_latent(x, x_lengths, sid, noise_scale, length_scale,
+                                                                  noise_scale_w)
+        o = self.run_module('dec', (z * y_mask)[:, :, :max_len], g=g)
+        return o, attn, y_mask, (z, z_p, m_p, logs_p)
 
-        if self.use_sdp:
-            logw = self.dp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w)
-        else:
-            logw = self.dp(x, x_mask, g=g)
+    def infer_latent(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1.):
+        """
+        文本编码、时长预测和 flow，得到送入声码器的 z
+        """
+        m_p, logs_p, x_mask, logw, g = self.infer_text(x, x_lengths, sid, noise_scale_w)
+        if torch.is_tensor(length_scale):
+            # 批量推理时每条一个语速 [b] -> [b, 1, 1]
+            length_scale = length_scale.view(-1, 1, 1)
         w = torch.exp(logw) * x_mask * length_scale
         w_ceil = torch.ceil(w)
         y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
@@ -523,9 +583,61 @@ class SynthesizerTrn(nn.Module):
                                                                                  2)  # [b, t', t], [b, t, d] -> [b, d, t']
 
         z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
-        z = self.flow(z_p, y_mask, g=g, reverse=True)
-        o = self.dec((z * y_mask)[:, :, :max_len], g=g)
-        return o, attn, y_mask, (z, z_p, m_p, logs_p)
+        z = self.run_module('flow', z_p, y_mask, g=g, reverse=True)
+        return z, y_mask, g, (attn, z_p, m_p, logs_p)
+
+    def infer_text(self, x, x_lengths, sid=None, noise_scale_w=1., noise=None):
+        """
+        文本编码和时长预测，输出的长度与 x 相同
+        :param noise: 随机时长预测器的噪声 [b, 2, t]，None 时随机生成
+        :return: (m_p, logs_p, x_mask, logw, g)
+        """
+        x, m_p, logs_p, x_mask = self.run_module('enc_p', x, x_lengths)
+        if self.n_speakers > 0:
+            g = self.emb_g(sid).unsqueeze(-1)  # [b, h, 1]
+        else:
+            g = None
+
+        if self.use_sdp:
+            logw = self.run_module('dp', x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w, noise=noise)
+        else:
+            logw = self.run_module('dp', x, x_mask, g=g)
+        return m_p, logs_p, x_mask, logw, g
+
+    def infer_stream(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1.,
+                     chunk_frames=32, context_frames=16, crossfade_frames=1):
+        """
+        flow 只跑一次，声码器按窗口分段解码并逐段返回波形，第一段在一个窗口解码完后即可输出，
+        声码器的显存/内存占用与句子长度无关。只支持 batch 为 1
+        :param chunk_frames: 每次输出的帧数，每帧 hop_length 个采样点
+        :param context_frames: 窗口两侧额外解码的帧数，需覆盖声码器的感受野，否则接缝处会失真
+        :param crossfade_frames: 相邻两段重叠的帧数，重叠部分做线性淡入淡出，不超过 context_frames
+        :return: 生成器，依次产出 [chunk_samples] 的张量
+        """
+        assert x.size(0) == 1, "infer_stream only supports batch size 1."
+        assert crossfade_frames <= context_frames, "crossfade_frames must not exceed context_frames."
+        z, y_mask, g, _ = self.infer_latent(x, x_lengths, sid, noise_scale, length_scale, noise_scale_w)
+        z = z * y_mask
+        hop_length = math.prod(self.upsample_rates)
+        fade = crossfade_frames * hop_length
+        fade_in = torch.linspace(0, 1, fade, device=z.device, dtype=z.dtype) if fade else None
+        length = z.size(2)
+        tail = None
+        for start in range(0, length, chunk_frames):
+            end = min(start + chunk_frames, length)
+            left = max(0, start - context_frames)
+            right = min(length, end + context_frames)
+            o = self.run_module('dec', z[:, :, left:right], g=g)[0, 0]
+            # 最后一段之外多取 fade 个采样点留给下一段淡入淡出
+            extra = fade if end < length else 0
+            chunk = o[(start - left) * hop_length:(end - left) * hop_length + extra]
+            if tail is not None:
+                n = min(tail.size(0), chunk.size(0))
+                chunk[:n] = tail[:n] * (1 - fade_in[:n]) + chunk[:n] * fade_in[:n]
+            if extra:
+                tail = chunk[-extra:]
+                chunk = chunk[:-extra]
+            yield chunk
 
     def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
         assert self.n_speakers > 0, "n_speakers have to be larger than 0."
@@ -0,0 +1,92 @@
+import json
+import os
+
+import torch
+
+import tts_module.vits.commons as commons
+from tts_module.vits.models import SynthesizerTrn
+from tts_module.vits.onnx_export import ENCODER_FILE, FLOW_FILE, DECODER_FILE, META_FILE
+
+
+class OnnxSynthesizer:
+    """
+    用 onnxruntime 运行 export_onnx 导出的子图，接口与 SynthesizerTrn 的 infer / infer_stream 相同，
+    输入输出都是 torch 张量，ViTs 中的调用方不需要修改
+    """
+
+    def __init__(self, model_dir, intra_op_threads=None, inter_op_threads=None):
+        """
+        :param model_dir: export_onnx 的输出目录
+        :param intra_op_threads: 单个算子内部的线程数，None 时由 onnxruntime 决定
+        :param inter_op_threads: 算子之间并行的线程数
+        """
+        import onnxruntime
+
+        with open(os.path.join(model_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.n_speakers = meta['n_speakers']
+        self.use_sdp = meta['use_sdp']
+        self.upsample_rates = meta['upsample_rates']
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads is not None:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        providers = ['CPUExecutionProvider']
+
+        def session(name):
+            return onnxruntime.InferenceSession(os.path.join(model_dir, name), options, providers=providers)
+
+        self.encoder = session(ENCODER_FILE)
+        self.flow = session(FLOW_FILE)
+        self.decoder = session(DECODER_FILE)
+        self.memory_size = sum(os.path.getsize(os.path.join(model_dir, name))
+                               for name in (ENCODER_FILE, FLOW_FILE, DECODER_FILE))
+
+    def _feeds(self, feeds, sid):
+        if self.n_speakers > 0:
+            feeds['sid'] = sid.cpu().numpy()
+        return feeds
+
+    def infer_latent(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1.):
+        """
+        与 SynthesizerTrn.infer_latent 相同，返回的 g 在这里是 sid，只用于传给 dec
+        """
+        dp_noise = torch.randn(x.size(0), 2, x.size(1)) * noise_scale_w
+        m_p, logs_p, x_mask, logw = [torch.from_numpy(o) for o in self.encoder.run(None, self._feeds({
+            'x': x.cpu().numpy(),
+            'x_lengths': x_lengths.cpu().numpy(),
+            'dp_noise': dp_noise.numpy()
+        }, sid))]
+        if torch.is_tensor(length_scale):
+            length_scale = length_scale.cpu().view(-1, 1, 1)
+        w = torch.exp(logw) * x_mask * length_scale
+        w_ceil = torch.ceil(w)
+        y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+        y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, None), 1).to(x_mask.dtype)
+        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+        attn = commons.generate_path(w_ceil, attn_mask)
+
+        m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2)
+        logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2)
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        z = torch.from_numpy(self.flow.run(None, self._feeds({
+            'z_p': z_p.numpy(),
+            'y_mask': y_mask.numpy()
+        }, sid))[0])
+        return z, y_mask, sid, (attn, z_p, m_p, logs_p)
+
+    def dec(self, z, g=None):
+        """
+        :param g: infer_latent 返回的 sid
+        """
+        return torch.from_numpy(self.decoder.run(None, self._feeds({'z': z.contiguous().numpy()}, g))[0])
+
+    # 解码流程与 PyTorch 模型相同，精度由导出的图决定，不使用 autocast
+    bf16_modules = frozenset()
+    run_module = SynthesizerTrn.run_module
+    infer = SynthesizerTrn.infer
+    infer_stream = SynthesizerTrn.infer_stream
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+from torch import nn
+
+# 导出的三个子图，文件名与 OnnxSynthesizer 中一致
+ENCODER_FILE = 'encoder.onnx'
+FLOW_FILE = 'flow.onnx'
+DECODER_FILE = 'decoder.onnx'
+META_FILE = 'meta.json'
+
+
+class _Encoder(nn.Module):
+    """
+    文本编码 + 时长预测，随机时长预测器的噪声作为输入传入
+    """
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x, x_lengths, dp_noise, sid=None):
+        x, m_p, logs_p, x_mask = self.net.enc_p(x, x_lengths)
+        g = self.net.emb_g(sid).unsqueeze(-1) if sid is not None else None
+        if self.net.use_sdp:
+            logw = self.net.dp(x, x_mask, g=g, reverse=True, noise_scale=1.0, noise=dp_noise)
+        else:
+            logw = self.net.dp(x, x_mask, g=g)
+        return m_p, logs_p, x_mask, logw
+
+
+class _Flow(nn.Module):
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, z_p, y_mask, sid=None):
+        g = self.net.emb_g(sid).unsqueeze(-1) if sid is not None else None
+        return self.net.flow(z_p, y_mask, g=g, reverse=True)
+
+
+class _Decoder(nn.Module):
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, z, sid=None):
+        g = self.net.emb_g(sid).unsqueeze(-1) if sid is not None else None
+        return self.net.dec(z, g=g)
+
+
+def export_onnx(net, output_dir, opset_version=17, source=None):
+    """
+    把 SynthesizerTrn 导出为 编码器(含时长预测)、flow、声码器 三个 onnx 子图，batch 和序列长度均为动态维度
+    中间的时长取整和对齐在 OnnxSynthesizer 中用 torch 完成
+    :param net: SynthesizerTrn，导出前会调用 prepare_for_inference
+    :param source: 导出来源 checkpoint 的标识，写入 meta，加载时据此判断导出结果是否过期
+    :return: output_dir
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    net = net.prepare_for_inference().cpu()
+    multi = net.n_speakers > 0
+    hidden_channels = net.hidden_channels
+    inter_channels = net.inter_channels
+
+    x = torch.randint(1, net.n_vocab, (1, 50), dtype=torch.long)
+    x_lengths = torch.LongTensor([50])
+    dp_noise = torch.randn(1, 2, 50)
+    sid = torch.LongTensor([0])
+    z = torch.randn(1, inter_channels, 120)
+    y_mask = torch.ones(1, 1, 120)
+    sid_args = (sid,) if multi else ()
+    sid_names = ['sid'] if multi else []
+    sid_axes = {'sid': {0: 'batch'}} if multi else {}
+
+    # 包装模块需为 eval 模式，导出结束后 torch 会把模型恢复为包装模块原来的模式
+    with torch.no_grad():
+        torch.onnx.export(_Encoder(net).eval(), (x, x_lengths, dp_noise) + sid_args,
+                          os.path.join(output_dir, ENCODER_FILE),
+                          input_names=['x', 'x_lengths', 'dp_noise'] + sid_names,
+                          output_names=['m_p', 'logs_p', 'x_mask', 'logw'],
+                          dynamic_axes={'x': {0: 'batch', 1: 'text'}, 'x_lengths': {0: 'batch'},
+                                        'dp_noise': {0: 'batch', 2: 'text'},
+                                        'm_p': {0: 'batch', 2: 'text'}, 'logs_p': {0: 'batch', 2: 'text'},
+                                        'x_mask': {0: 'batch', 2: 'text'}, 'logw': {0: 'batch', 2: 'text'},
+                                        **sid_axes},
+                          opset_version=opset_version, dynamo=False)
+        torch.onnx.export(_Flow(net).eval(), (z, y_mask) + sid_args, os.path.join(output_dir, FLOW_FILE),
+                          input_names=['z_p', 'y_mask'] + sid_names, output_names=['z'],
+                          dynamic_axes={'z_p': {0: 'batch', 2: 'frames'}, 'y_mask': {0: 'batch', 2: 'frames'},
+                                        'z': {0: 'batch', 2: 'frames'}, **sid_axes},
+                          opset_version=opset_version, dynamo=False)
+        torch.onnx.export(_Decoder(net).eval(), (z,) + sid_args, os.path.join(output_dir, DECODER_FILE),
+                          input_names=['z'] + sid_names, output_names=['audio'],
+                          dynamic_axes={'z': {0: 'batch', 2: 'frames'}, 'audio': {0: 'batch', 2: 'samples'},
+                                        **sid_axes},
+                          opset_version=opset_version, dynamo=False)
+
+    with open(os.path.join(output_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'n_speakers': net.n_speakers,
+            'use_sdp': net.use_sdp,
+            'upsample_rates': list(net.upsample_rates),
+            'hidden_channels': hidden_channels,
+            'inter_channels': inter_channels,
+            'source': source
+        }, f)
+    logging.info(f'exported onnx model to {output_dir}')
+    return output_dir
+
+
+def verify_onnx(net, onnx_synthesizer, sequences, sid=0, atol=1e-3):
+    """
+    关闭噪声后比较 PyTorch 与 onnxruntime 的输出
+    :param sequences: 若干条音素 id 序列（LongTensor）
+    :return: 最大绝对误差，超出 atol 时抛出 ValueError
+    """
+    max_diff = 0.0
+    for seq in sequences:
+        x = seq.unsqueeze(0)
+        x_lengths = torch.LongTensor([seq.size(0)])
+        sid_tensor = torch.LongTensor([sid]) if net.n_speakers > 0 else None
+        with torch.no_grad():
+            expected = net.infer(x, x_lengths, sid=sid_tensor, noise_scale=0, noise_scale_w=0)[0]
+            actual = onnx_synthesizer.infer(x, x_lengths, sid=sid_tensor, noise_scale=0, noise_scale_w=0)[0]
+        if expected.shape != actual.shape:
+            raise ValueError(f'onnx output shape {tuple(actual.shape)} != torch output shape {tuple(expected.shape)}')
+        max_diff = max(max_diff, float(np.abs(expected.numpy() - actual.numpy()).max()))
+    if max_diff > atol:
+        raise ValueError(f'onnx output differs from torch by {max_diff:.2e} (atol {atol:.0e})')
+    logging.info(f'onnx export verified, max abs diff {max_diff:.2e}')
+    return max_diff
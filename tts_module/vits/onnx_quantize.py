@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+
+from tts_module.vits.onnx_backend import OnnxSynthesizer
+from tts_module.vits.onnx_export import ENCODER_FILE, FLOW_FILE, DECODER_FILE, META_FILE
+
+# 子图名 -> 文件名，子图名与 OnnxSynthesizer 的属性名一致
+GRAPHS = {
+    'encoder': ENCODER_FILE,
+    'flow': FLOW_FILE,
+    'decoder': DECODER_FILE
+}
+
+# 默认的校准语句，覆盖中日两种语言和常见标点
+CALIBRATION_TEXTS = [
+    '[ZH]老师好！我是爱丽丝，今天也请多指教。[ZH]',
+    '[ZH]这个游戏真有意思，我们再玩一局吧？[ZH]',
+    '[ZH]从前有一位勇者，她在废墟里醒来，什么都不记得了。[ZH]',
+    '[ZH]嗯……让我想一想。[ZH]',
+    '[JA]こんにちは、よろしくお願いします！[JA]',
+    '[JA]新しいゲームを見つけました。一緒に遊びませんか？[JA]',
+    '[JA]ありがとう。[JA]',
+    '[JA]でも、仲間たちがいつもそばにいました。[JA]'
+]
+
+
+class _RecordingSession:
+    """
+    记录每次推理的输入，作为静态量化的校准数据
+    """
+
+    def __init__(self, session, records):
+        self.session = session
+        self.records = records
+
+    def run(self, output_names, feeds):
+        self.records.append(dict(feeds))
+        return self.session.run(output_names, feeds)
+
+
+class _CalibrationReader:
+    def __init__(self, feeds):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+    def rewind(self):
+        pass
+
+
+def collect_calibration_inputs(model_dir, sequences, sid=None):
+    """
+    用 fp32 模型推理一遍校准语句，记录每个子图的输入
+    :param sequences: 音素 id 序列（LongTensor）
+    :return: {子图名: [feeds]}
+    """
+    net = OnnxSynthesizer(model_dir)
+    records = {name: [] for name in GRAPHS}
+    for name in GRAPHS:
+        setattr(net, name, _RecordingSession(getattr(net, name), records[name]))
+    for seq in sequences:
+        # 使用与实际合成相同的噪声参数，激活值的分布才有代表性
+        net.infer(seq.unsqueeze(0), torch.LongTensor([seq.size(0)]), sid=sid, noise_scale=0.6,
+                  noise_scale_w=0.668)
+    return records
+
+
+def quantize_onnx(model_dir, output_dir, mode='static', calibration_inputs=None):
+    """
+    把 export_onnx 导出的子图量化为 int8，量化卷积和矩阵乘
+    :param mode: 'dynamic' 只量化权重，激活在运行时量化；'static' 权重和激活都量化，需要校准数据，CPU 上更快
+    :param calibration_inputs: collect_calibration_inputs 的结果，static 时必须提供
+    """
+    from onnxruntime.quantization import (QuantFormat, QuantType, quantize_dynamic, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if mode not in ('dynamic', 'static'):
+        raise ValueError(f'unknown quantization mode: {mode}')
+    if mode == 'static' and calibration_inputs is None:
+        raise ValueError('static quantization requires calibration inputs')
+    os.makedirs(output_dir, exist_ok=True)
+    for name, file in GRAPHS.items():
+        src = os.path.join(model_dir, file)
+        dst = os.path.join(output_dir, file)
+        # 先做常量折叠，部分卷积的权重在导出的图中不是 initializer，量化工具无法处理
+        pre = os.path.join(output_dir, f'pre_{file}')
+        quant_pre_process(src, pre, skip_symbolic_shape=True)
+        try:
+            if mode == 'dynamic':
+                quantize_dynamic(pre, dst, weight_type=QuantType.QUInt8, op_types_to_quantize=['Conv', 'MatMul'])
+            else:
+                quantize_static(pre, dst, _CalibrationReader(calibration_inputs[name]), quant_format=QuantFormat.QDQ,
+                                per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                                op_types_to_quantize=['Conv', 'ConvTranspose', 'MatMul'])
+        finally:
+            os.remove(pre)
+
+    with open(os.path.join(model_dir, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['quantization'] = mode
+    with open(os.path.join(output_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    logging.info(f'{mode} int8 model saved to {output_dir}')
+    return output_dir
+
+
+def spectral_distance(reference, test, n_fft=1024, hop_length=256):
+    """
+    对数谱距离 (log-spectral distance)，单位 dB，越小越接近
+    :param reference: 参考波形，一维数组或张量
+    :param test: 待比较的波形，长度不同时截取到较短的长度
+    """
+    reference = torch.as_tensor(np.asarray(reference, dtype=np.float32))
+    test = torch.as_tensor(np.asarray(test, dtype=np.float32))
+    length = min(reference.size(0), test.size(0))
+    window = torch.hann_window(n_fft)
+
+    def log_spectrum(wav):
+        spec = torch.stft(wav[:length], n_fft, hop_length, window=window, return_complex=True).abs()
+        return 20 * torch.log10(spec.clamp_min(1e-5))
+
+    diff = log_spectrum(reference) - log_spectrum(test)
+    return float(diff.pow(2).mean(0).sqrt().mean())
+
+
+def evaluate_quality(reference_net, test_net, sequences, sid=None):
+    """
+    关闭噪声后比较两个模型的输出
+    :return: {'lsd_mean', 'lsd_max'}，单位 dB
+    """
+    distances = []
+    for seq in sequences:
+        x = seq.unsqueeze(0)
+        x_lengths = torch.LongTensor([seq.size(0)])
+        with torch.no_grad():
+            reference = reference_net.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)[0][0, 0]
+            test = test_net.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)[0][0, 0]
+        distances.append(spectral_distance(reference.cpu(), test.cpu()))
+    return {
+        'lsd_mean': float(np.mean(distances)),
+        'lsd_max': float(np.max(distances))
+    }
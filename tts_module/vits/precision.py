@@ -0,0 +1,121 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import torch
+
+from tts_module.vits.onnx_quantize import spectral_distance
+
+# 精度策略 -> 在 bfloat16 下运行的子模块
+# dp 中的有理二次样条和 flow 的可逆变换对精度敏感，默认的策略都保持 fp32
+PRECISION_POLICIES = {
+    'fp32': (),
+    'bf16-enc': ('enc_p',),
+    'bf16-dec': ('dec',),
+    'bf16': ('enc_p', 'dec')
+}
+
+BENCHMARK_TEXTS = [
+    '[ZH]老师好！我是爱丽丝，今天也请多指教。[ZH]',
+    '[ZH]从前有一位勇者，她在废墟里醒来，什么都不记得了，但是伙伴们一直陪在她身边。[ZH]',
+    '[JA]新しいゲームを見つけました。一緒に遊びませんか？[JA]'
+]
+
+
+def bf16_supported(device='cpu'):
+    """
+    CPU 需要支持 AVX512-BF16 / AMX 等指令，否则 bfloat16 会比 fp32 慢很多
+    """
+    if str(device).startswith('cuda'):
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_policy(policy, device='cpu', force=False):
+    """
+    :param policy: PRECISION_POLICIES 中的名字，或子模块名的列表
+    :param force: 设备不支持时也使用 bfloat16，只用于测试
+    :return: 子模块名的元组，设备不支持 bfloat16 时返回空元组
+    """
+    modules = PRECISION_POLICIES[policy] if isinstance(policy, str) else tuple(policy)
+    if modules and not force and not bf16_supported(device):
+        logging.warning(f'bfloat16 is not supported on {device}, precision policy {policy} falls back to fp32')
+        return ()
+    return modules
+
+
+def benchmark_policies(vits, texts=None, policies=None, runs=3, force=False):
+    """
+    对已加载角色的 ViTs 依次测试各个精度策略，关闭噪声后与 fp32 的输出比较音质
+    :param force: 设备不支持 bfloat16 时也强制测试
+    :return: {策略名: {'latency', 'rtf', 'lsd_mean', 'lsd_max'}}，latency 为每句的平均秒数
+    """
+    texts = texts or BENCHMARK_TEXTS
+    policies = policies or list(PRECISION_POLICIES)
+    original = vits.precision
+    # 测试期间不使用波形缓存
+    wave_cache, vits.wave_cache = vits.wave_cache, None
+    reference = None
+    results = {}
+    try:
+        for policy in ['fp32'] + [p for p in policies if p != 'fp32']:
+            vits.set_precision(policy, force=force)
+            # 预热一次，autocast 第一次运行需要转换权重
+            vits.generate_speech(texts[0], ns=0, nsw=0)
+            t1 = time.perf_counter()
+            for _ in range(runs):
+                wavs = [vits.generate_speech(text, ns=0, nsw=0) for text in texts]
+            elapsed = (time.perf_counter() - t1) / runs
+            if reference is None:
+                reference = wavs
+            distances = [spectral_distance(r, w) for r, w in zip(reference, wavs)]
+            if policy in policies:
+                results[policy] = {
+                    'latency': elapsed / len(texts),
+                    'rtf': elapsed / (sum(len(w) for w in wavs) / vits.hps_ms.data.sampling_rate),
+                    'lsd_mean': float(np.mean(distances)),
+                    'lsd_max': float(np.max(distances))
+                }
+    finally:
+        vits.set_precision(original)
+        vits.wave_cache = wave_cache
+    return results
+
+
+# 在当前机器上测试各精度策略的速度和音质，选出最合适的写入配置的 tts_precision
+# 示例用法
+# python -m tts_module.vits.precision --speaker 天童爱丽丝 --runs 3
+def main():
+    from resources import resource_loader
+    from tts_module.vits import ViTs
+
+    parser = argparse.ArgumentParser(description='语音合成精度策略基准')
+    parser.add_argument('--speaker', type=str, default='天童爱丽丝')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--policies', type=str, nargs='+', default=list(PRECISION_POLICIES),
+                        choices=list(PRECISION_POLICIES))
+    parser.add_argument('--force', action='store_true', help='设备不支持 bfloat16 时也强制测试')
+    args = parser.parse_args()
+
+    vits = ViTs(resource_loader.get_path('vits', 'config', 'config.json'),
+                resource_loader.get_path('vits', 'pretrained_models', 'info.json'),
+                resource_loader.get_path('vits', 'pretrained_models'),
+                device=args.device)
+    vits.load_model(args.speaker)
+    if not bf16_supported(args.device) and not args.force:
+        print(f'bfloat16 is not supported on {args.device}, all policies run in fp32 (use --force to test anyway)')
+    results = benchmark_policies(vits, policies=args.policies, runs=args.runs, force=args.force)
+
+    print(f"{'policy':<12}{'latency':>10}{'rtf':>10}{'lsd_mean':>10}{'lsd_max':>10}")
+    for policy, r in results.items():
+        print(f"{policy:<12}{r['latency']:>10.3f}{r['rtf']:>10.3f}{r['lsd_mean']:>10.2f}{r['lsd_max']:>10.2f}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,4 +1,7 @@
 """ from https://github.com/keithito/tacotron """
+import numpy as np
+import torch
+
 from . import cleaners
 from .symbols import symbols
 
@@ -8,6 +11,81 @@ _symbol_to_id = {s: i for i, s in enumerate(symbols)}
 _id_to_symbol = {i: s for i, s in enumerate(symbols)}
 
 
+def _utf32(text):
+  # surrogatepass keeps lone surrogates as their own code points; they are outside the table and get dropped
+  return text.encode('utf-32-le', 'surrogatepass')
+
+
+class SymbolEncoder:
+  '''Maps cleaned text to symbol IDs through a lookup array indexed by code point.
+    Build it once per symbol table with get_encoder(symbols).
+  '''
+  def __init__(self, symbols):
+    self.symbols = tuple(symbols)
+    # Only single-character symbols can match, since cleaned text is scanned character by character
+    chars = [s for s in self.symbols if len(s) == 1]
+    # The last slot is -1 and catches every code point outside the table
+    self.table = np.full(max((ord(c) for c in chars), default=0) + 2, -1, dtype=np.int64)
+    for i, s in enumerate(self.symbols):
+      if len(s) == 1:
+        self.table[ord(s)] = i
+
+  def ids(self, clean_text):
+    '''Returns the IDs of the known symbols in clean_text as an int64 array; unknown characters are dropped'''
+    codes = np.frombuffer(_utf32(clean_text), dtype=np.uint32)
+    ids = self.table[np.minimum(codes, len(self.table) - 1)]
+    return ids[ids >= 0]
+
+  def encode(self, clean_text, add_blank=False):
+    '''Returns a LongTensor of IDs, with blank (0) inserted around every symbol when add_blank is set'''
+    return self.from_ids(self.ids(clean_text), add_blank)
+
+  @staticmethod
+  def from_ids(ids, add_blank=False):
+    ids = np.asarray(ids, dtype=np.int64)
+    if add_blank:
+      result = np.zeros(len(ids) * 2 + 1, dtype=np.int64)
+      result[1::2] = ids
+      ids = result
+    return torch.from_numpy(ids)
+
+  def encode_batch(self, clean_texts, add_blank=False):
+    '''Encodes many strings with a single lookup.
+      Returns:
+        (LongTensor [batch, max_length] padded with 0, LongTensor [batch] of lengths)
+    '''
+    codes = np.frombuffer(_utf32(''.join(clean_texts)), dtype=np.uint32)
+    ids = self.table[np.minimum(codes, len(self.table) - 1)]
+    # Index of the string each character belongs to
+    owners = np.repeat(np.arange(len(clean_texts)), [len(t) for t in clean_texts])
+    keep = ids >= 0
+    ids, owners = ids[keep], owners[keep]
+    counts = np.bincount(owners, minlength=len(clean_texts))
+    positions = np.arange(len(ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    lengths = counts * 2 + 1 if add_blank else counts
+    if add_blank:
+      positions = positions * 2 + 1
+    result = np.zeros((len(clean_texts), max(lengths, default=0)), dtype=np.int64)
+    result[owners, positions] = ids
+    return torch.from_numpy(result), torch.from_numpy(lengths.astype(np.int64))
+
+  def text_to_sequence(self, text, cleaner_names):
+    clean_text = _clean_text(text, cleaner_names)
+    return self.ids(clean_text).tolist(), clean_text
+
+
+_encoders = {}
+
+
+def get_encoder(symbols):
+  '''Returns the SymbolEncoder for a symbol table, building it on first use'''
+  key = tuple(symbols)
+  encoder = _encoders.get(key)
+  if encoder is None:
+    encoder = _encoders[key] = SymbolEncoder(key)
+  return encoder
+
+
 def text_to_sequence(text, symbols, cleaner_names):
   '''Converts a string of text to a sequence of IDs corresponding to the symbols in the text.
     Args:
@@ -16,16 +94,7 @@ def text_to_sequence(text, symbols, cleaner_names):
     Returns:
       List of integers corresponding to the symbols in the text
   '''
-  _symbol_to_id = {s: i for i, s in enumerate(symbols)}
-  sequence = []
-
-  clean_text = _clean_text(text, cleaner_names)
-  for symbol in clean_text:
-    if symbol not in _symbol_to_id.keys():
-      continue
-    symbol_id = _symbol_to_id[symbol]
-    sequence += [symbol_id]
-  return sequence, clean_text
+  return get_encoder(symbols).text_to_sequence(text, cleaner_names)
 
 
 def cleaned_text_to_sequence(cleaned_text):
@@ -0,0 +1,151 @@
+""" Micro-benchmarks of the text frontend in cleaners.py.
+
+Compares every MultiReplacer against the sequential re.sub loop on random text of increasing length,
+and the full-context label parser of japanese_to_romaji_with_accent against the per-field re.search
+version on Japanese paragraphs. Both check that the outputs agree and report the cost per character.
+
+Usage:
+  python -m tts_module.vits.text.benchmark --lengths 16 256 4096
+  python -m tts_module.vits.text.benchmark --labels --paragraphs 1 4 16
+"""
+
+import argparse
+import random
+import re
+import time
+
+from tts_module.vits.text import cleaners
+
+
+def _alphabet(table):
+  chars = set()
+  for regex, _ in table:
+    chars.update(regex.pattern)
+  # Characters that no pattern matches, so the scan also has to skip over text
+  chars.update(' ,.!?')
+  return sorted(chars)
+
+
+def _time_per_char(fn, texts, runs):
+  total = sum(len(t) for t in texts)
+  best = None
+  for _ in range(runs):
+    start = time.perf_counter()
+    for t in texts:
+      fn(t)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best / total * 1e9
+
+
+def run(lengths=(16, 64, 256, 1024, 4096), samples=20, runs=5, seed=0):
+  '''Returns a list of (table name, length, sequential ns/char, single-pass ns/char).'''
+  rng = random.Random(seed)
+  replacers = {
+    'latin_to_hangul': cleaners._latin_to_hangul_replacer,
+    'divide_hangul': cleaners._hangul_divided_replacer,
+    'latin_to_bopomofo': cleaners._latin_to_bopomofo_replacer,
+    'bopomofo_to_romaji': cleaners._bopomofo_to_romaji_replacer,
+  }
+  results = []
+  for name, replacer in replacers.items():
+    alphabet = _alphabet(replacer.table)
+    for length in lengths:
+      texts = [''.join(rng.choice(alphabet) for _ in range(length)) for _ in range(samples)]
+      for t in texts:
+        if replacer(t) != replacer.sequential(t):
+          raise AssertionError('%s differs from the sequential version on %r' % (name, t))
+      sequential = _time_per_char(replacer.sequential, texts, runs)
+      single = _time_per_char(replacer, texts, runs)
+      results.append((name, length, sequential, single))
+  return results
+
+
+# Sentences repeated to build the Japanese paragraphs:
+_japanese_sentences = [
+  'こんにちは、よろしくお願いします！',
+  '新しいゲームを見つけました。一緒に遊びませんか？',
+  '昨日は東京で友達と映画を見て、そのあと駅前の喫茶店でケーキを食べました。',
+  'でも、仲間たちがいつもそばにいてくれたので、少しも寂しくありませんでした。',
+  '先生、この問題の答えをもう一度説明していただけますか。',
+]
+
+
+def _reference_labels_to_romaji(labels):
+  '''The label loop of japanese_to_romaji_with_accent before _parse_labels: five re.search calls per
+    label, and the next label parsed again.
+  '''
+  text = ''
+  for n, label in enumerate(labels):
+    phoneme = re.search(r'\-([^\+]*)\+', label).group(1)
+    if phoneme not in ['sil','pau']:
+      text += phoneme.replace('ch','ʧ').replace('sh','ʃ').replace('cl','Q')
+    else:
+      continue
+    n_moras = int(re.search(r'/F:(\d+)_', label).group(1))
+    a1 = int(re.search(r"/A:(\-?[0-9]+)\+", label).group(1))
+    a2 = int(re.search(r"\+(\d+)\+", label).group(1))
+    a3 = int(re.search(r"\+(\d+)/", label).group(1))
+    if re.search(r'\-([^\+]*)\+', labels[n + 1]).group(1) in ['sil','pau']:
+      a2_next=-1
+    else:
+      a2_next = int(re.search(r"\+(\d+)\+", labels[n + 1]).group(1))
+    # Accent phrase boundary
+    if a3 == 1 and a2_next == 1:
+      text += ' '
+    # Falling
+    elif a1 == 0 and a2_next == a2 + 1 and a2 != n_moras:
+      text += '↓'
+    # Rising
+    elif a2 == 1 and a2_next == 2:
+      text += '↑'
+  return text
+
+
+def run_labels(paragraphs=(1, 4, 16), runs=5):
+  '''Returns a list of (sentences per paragraph, characters, labels, reference ns/char,
+    single-match ns/char, share of japanese_to_romaji_with_accent spent in the reference loop).
+  '''
+  cleaners._require('pyopenjtalk')
+  results = []
+  for count in paragraphs:
+    sentences = [_japanese_sentences[i % len(_japanese_sentences)] for i in range(count)]
+    text = ''.join(sentences)
+    # Label extraction is the same for both versions and is left out of the per-label timings
+    labels = [cleaners.pyopenjtalk.extract_fullcontext(s) for s in sentences]
+    for x in labels:
+      if cleaners._labels_to_romaji(x) != _reference_labels_to_romaji(x):
+        raise AssertionError('label parsers differ on %r' % ''.join(x))
+    reference = _time_per_char(lambda _: [_reference_labels_to_romaji(x) for x in labels], [text], runs)
+    single = _time_per_char(lambda _: [cleaners._labels_to_romaji(x) for x in labels], [text], runs)
+    total = _time_per_char(cleaners.japanese_to_romaji_with_accent, [text], runs)
+    share = reference / (total - single + reference)
+    results.append((count, len(text), sum(len(x) for x in labels), reference, single, share))
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description='text frontend micro-benchmarks')
+  parser.add_argument('--lengths', type=int, nargs='+', default=[16, 64, 256, 1024, 4096])
+  parser.add_argument('--samples', type=int, default=20)
+  parser.add_argument('--runs', type=int, default=5)
+  parser.add_argument('--labels', action='store_true', help='benchmark the full-context label parser instead')
+  parser.add_argument('--paragraphs', type=int, nargs='+', default=[1, 4, 16],
+                      help='sentences per Japanese paragraph for --labels')
+  args = parser.parse_args()
+
+  if args.labels:
+    print('%10s%8s%8s%14s%14s%10s%10s' % ('sentences', 'chars', 'labels', 'ref ns/char', 'one ns/char',
+                                          'speedup', 'ref share'))
+    for count, chars, labels, reference, single, share in run_labels(args.paragraphs, args.runs):
+      print('%10d%8d%8d%14.1f%14.1f%9.1fx%9.0f%%' % (count, chars, labels, reference, single,
+                                                    reference / single, share * 100))
+    return
+
+  print('%-20s%8s%14s%14s%10s' % ('table', 'length', 'seq ns/char', 'one ns/char', 'speedup'))
+  for name, length, sequential, single in run(args.lengths, args.samples, args.runs):
+    print('%-20s%8d%14.1f%14.1f%9.1fx' % (name, length, sequential, single, sequential / single))
+
+
+if __name__ == '__main__':
+  main()
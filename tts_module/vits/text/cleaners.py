@@ -12,12 +12,32 @@ hyperparameter. Some cleaners are English-specific. You'll typically want to use
      the symbols in symbols.py to match your data).
 '''
 
+import os
 import re
-from unidecode import unidecode
-import pyopenjtalk
-from jamo import h2j, j2hcj
-from pypinyin import lazy_pinyin, BOPOMOFO
-import jieba, cn2an
+
+# Third-party dependencies are imported on first use by _require, or up front for a model's cleaners by
+# load_cleaners, so a model only pays the import time of the languages it handles.
+unidecode = pyopenjtalk = h2j = j2hcj = lazy_pinyin = BOPOMOFO = jieba = cn2an = None
+_loaded = set()
+
+# Dependencies of each cleaner:
+_cleaner_dependencies = {
+  'transliteration_cleaners': ('unidecode',),
+  'japanese_cleaners': ('pyopenjtalk', 'unidecode'),
+  'japanese_cleaners2': ('pyopenjtalk', 'unidecode'),
+  'korean_cleaners': ('jamo',),
+  'chinese_cleaners': ('cn2an', 'jieba', 'pypinyin'),
+  'zh_ja_mixture_cleaners': ('cn2an', 'jieba', 'pypinyin', 'pyopenjtalk', 'unidecode'),
+}
+
+# Text run through each cleaner by warm_up, covering the dictionaries loaded on first call:
+_warmup_texts = {
+  'japanese_cleaners': 'こんにちは、よろしくお願いします。',
+  'japanese_cleaners2': 'こんにちは、よろしくお願いします。',
+  'korean_cleaners': '안녕하세요, 1개 주세요.',
+  'chinese_cleaners': '老师好，今天是1号。',
+  'zh_ja_mixture_cleaners': '[ZH]老师好，今天是1号。[ZH][JA]こんにちは、よろしくお願いします。[JA]',
+}
 
 
 # This is a list of Korean classifiers preceded by pure Korean numerals.
@@ -32,8 +52,11 @@ _japanese_characters = re.compile(r'[A-Za-z\d\u3005\u3040-\u30ff\u4e00-\u9fff\uf
 # Regular expression matching non-Japanese characters or punctuation marks:
 _japanese_marks = re.compile(r'[^A-Za-z\d\u3005\u3040-\u30ff\u4e00-\u9fff\uff11-\uff19\uff21-\uff3a\uff41-\uff5a\uff66-\uff9d]')
 
-# List of (regular expression, replacement) pairs for abbreviations:
-_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in [
+# Regular expression matching the phoneme and the A1, A2, A3 and F1 fields of a full-context label:
+_label_re = re.compile(r'[^-]*-([^+]*)\+.*?/A:(-?\d+|xx)\+(\d+|xx)\+(\d+|xx)/.*?/F:(\d+|xx)_')
+
+# List of (abbreviation, expansion) pairs:
+_abbreviation_pairs = [
   ('mrs', 'misess'),
   ('mr', 'mister'),
   ('dr', 'doctor'),
@@ -52,7 +75,10 @@ _abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in
   ('ltd', 'limited'),
   ('col', 'colonel'),
   ('ft', 'fort'),
-]]
+]
+
+# List of (regular expression, replacement) pairs for abbreviations:
+_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in _abbreviation_pairs]
 
 # List of (hangul, hangul divided) pairs:
 _hangul_divided = [(re.compile('%s' % x[0]), x[1]) for x in [
@@ -204,10 +230,166 @@ _bopomofo_to_romaji = [(re.compile('%s' % x[0], re.IGNORECASE), x[1]) for x in [
 ]]
 
 
+class MultiReplacer:
+  '''Applies a table of (regular expression, replacement) pairs in a single scan.
+
+    The result is the same as running re.sub for every pair in order. That only holds when an earlier
+    replacement can never produce or break a match of a later pattern, so the table is checked once here
+    and falls back to one re.sub per pair when the check fails.
+
+    Single-character patterns are further applied with str.translate, so dense text does not pay for a
+    Python callback per match; only the multi-character patterns go through the combined regex.
+  '''
+  def __init__(self, table):
+    self.table = table
+    self.replacements = [replacement for _, replacement in table]
+    self.regex = None
+    self.translation = None
+    if self._single_pass_safe():
+      patterns = ['(%s)' % regex.pattern for regex, _ in table]
+      self.regex = re.compile('|'.join(patterns), table[0][0].flags)
+      self._build_translation()
+
+  def _build_translation(self):
+    flags = self.table[0][0].flags
+    multi = [(i, regex.pattern, r) for i, (regex, r) in enumerate(self.table) if len(regex.pattern) > 1]
+    single = [(i, regex.pattern, r) for i, (regex, r) in enumerate(self.table) if len(regex.pattern) == 1]
+    if not single:
+      return
+    # The multi-character patterns run first, so a single-character pattern listed before one of them
+    # must not match its text or its replacement
+    for i, p, _ in single:
+      for j, q, r in multi:
+        if i < j and re.search(re.escape(p), q + r, flags):
+          return
+    translation = {}
+    for _, p, r in single:
+      for c in (p, p.lower(), p.upper()):
+        if c not in translation and len(c) == 1 and re.fullmatch(re.escape(p), c, flags):
+          translation[c] = r
+    self.translation = str.maketrans(translation)
+    self.multi_replacements = [r for _, _, r in multi]
+    self.multi_regex = re.compile('|'.join('(%s)' % q for _, q, _ in multi), flags) if multi else None
+    # Case-insensitive matches outside the translation table, such as the Kelvin sign for k
+    self.unlisted = re.compile('(?!(?-i:[%s]))[%s]' % (re.escape(''.join(translation)),
+                                                        re.escape(''.join(p for _, p, _ in single))), flags)
+
+  def _single_pass_safe(self):
+    if not self.table or len({regex.flags for regex, _ in self.table}) != 1:
+      return False
+    flags = self.table[0][0].flags
+    patterns = [regex.pattern for regex, _ in self.table]
+    # Only plain literals, and replacements without group references
+    if any(not p or re.escape(p) != p for p in patterns) or any('\\' in r for r in self.replacements):
+      return False
+
+    def starts_with(text, prefix):
+      return re.match(re.escape(prefix), text, flags) is not None
+
+    for i, (p, r) in enumerate(zip(patterns, self.replacements)):
+      for q in patterns[i + 1:]:
+        # A later pattern must not match anything a replacement writes ...
+        if any(re.search(re.escape(c), q, flags) for c in set(r)):
+          return False
+        # ... nor span the gap left by a deletion
+        if not r and len(q) > 1:
+          return False
+        # An earlier pattern inside or overlapping the end of a later one is replaced first in the
+        # sequential version, but the later one would win a left-to-right scan
+        if any(starts_with(q[k:], p) or starts_with(p, q[k:]) for k in range(1, len(q))):
+          return False
+    return True
+
+  def __call__(self, text):
+    if self.regex is None:
+      return self.sequential(text)
+    if self.translation is None or self.unlisted.search(text):
+      return self.regex.sub(lambda m: self.replacements[m.lastindex - 1], text)
+    if self.multi_regex is not None:
+      text = self.multi_regex.sub(lambda m: self.multi_replacements[m.lastindex - 1], text)
+    return text.translate(self.translation)
+
+  def sequential(self, text):
+    for regex, replacement in self.table:
+      text = re.sub(regex, replacement, text)
+    return text
+
+
+_abbreviations_re = re.compile(r'\b(%s)\.' % '|'.join(x[0] for x in _abbreviation_pairs), re.IGNORECASE)
+_abbreviation_index = {x[0]: i for i, x in enumerate(_abbreviation_pairs)}
+_latin_to_hangul_replacer = MultiReplacer(_latin_to_hangul)
+_hangul_divided_replacer = MultiReplacer(_hangul_divided)
+_latin_to_bopomofo_replacer = MultiReplacer(_latin_to_bopomofo)
+_bopomofo_to_romaji_replacer = MultiReplacer(_bopomofo_to_romaji)
+
+
+def _require(name):
+  '''Imports a third-party dependency into the module globals the first time it is needed'''
+  if name in _loaded:
+    return
+  global unidecode, pyopenjtalk, h2j, j2hcj, lazy_pinyin, BOPOMOFO, jieba, cn2an
+  if name == 'unidecode':
+    from unidecode import unidecode
+  elif name == 'pyopenjtalk':
+    import pyopenjtalk
+  elif name == 'jamo':
+    from jamo import h2j, j2hcj
+  elif name == 'pypinyin':
+    from pypinyin import lazy_pinyin, BOPOMOFO
+  elif name == 'jieba':
+    import jieba
+  elif name == 'cn2an':
+    import cn2an
+  else:
+    raise ValueError('Unknown dependency: %s' % name)
+  _loaded.add(name)
+
+
+def load_cleaners(cleaner_names):
+  '''Imports the dependencies of the given cleaners'''
+  for name in cleaner_names:
+    for dependency in _cleaner_dependencies.get(name, ()):
+      _require(dependency)
+
+
+def warm_up(cleaner_names, jieba_cache_dir=None):
+  '''Imports the dependencies of the given cleaners and loads their dictionaries, so the first request
+    does not pay for it. Safe to run in a background thread.
+    Args:
+      jieba_cache_dir: directory of jieba's prefix dictionary cache, built on the first run and loaded
+        from there afterwards; jieba's default is the system temp directory
+  '''
+  load_cleaners(cleaner_names)
+  if 'jieba' in _loaded:
+    if jieba_cache_dir is not None:
+      os.makedirs(jieba_cache_dir, exist_ok=True)
+      jieba.dt.tmp_dir = jieba_cache_dir
+    jieba.initialize()
+  for name in cleaner_names:
+    if name in _warmup_texts:
+      globals()[name](_warmup_texts[name])
+
+
 def expand_abbreviations(text):
-  for regex, replacement in _abbreviations:
-    text = re.sub(regex, replacement, text)
-  return text
+  # Same result as one re.sub per abbreviation: an expansion ends in a letter, so an abbreviation right
+  # after one that an earlier pattern expanded has lost its word boundary and is kept as it is
+  result = []
+  pos = 0
+  last_end, last_index = -1, None
+  for m in _abbreviations_re.finditer(text):
+    index = _abbreviation_index.get(m.group(1).lower())
+    if index is None:
+      # Case-insensitive matches such as the Kelvin sign do not lower() to the table key
+      index = next(i for i, x in enumerate(_abbreviation_pairs) if re.fullmatch(x[0], m.group(1), re.IGNORECASE))
+    if m.start() == last_end and last_index is not None and last_index < index:
+      last_end, last_index = m.end(), None
+      continue
+    result.append(text[pos:m.start()])
+    result.append(_abbreviation_pairs[index][1])
+    pos = m.end()
+    last_end, last_index = m.end(), index
+  result.append(text[pos:])
+  return ''.join(result)
 
 
 def lowercase(text):
@@ -219,11 +401,46 @@ def collapse_whitespace(text):
 
 
 def convert_to_ascii(text):
+  _require('unidecode')
   return unidecode(text)
 
 
+def _parse_labels(labels):
+  '''Decodes the fields used for the accent marks from a list of full-context labels in one match each.
+    Returns:
+      (phonemes, a1, a2, a3, f1) lists; the numeric fields are None where the label has xx
+  '''
+  if not labels:
+    return [], [], [], [], []
+  columns = list(zip(*(_label_re.match(label).groups() for label in labels)))
+  a1, a2, a3, f1 = ([None if v == 'xx' else int(v) for v in column] for column in columns[1:])
+  return list(columns[0]), a1, a2, a3, f1
+
+
+def _labels_to_romaji(labels):
+  phonemes, a1, a2, a3, n_moras = _parse_labels(labels)
+  text = []
+  for n, phoneme in enumerate(phonemes):
+    if phoneme in ('sil', 'pau'):
+      continue
+    text.append(phoneme.replace('ch','ʧ').replace('sh','ʃ').replace('cl','Q'))
+    a2_next = -1 if phonemes[n + 1] in ('sil', 'pau') else a2[n + 1]
+    # Accent phrase boundary
+    if a3[n] == 1 and a2_next == 1:
+      text.append(' ')
+    # Falling
+    elif a1[n] == 0 and a2_next == a2[n] + 1 and a2[n] != n_moras[n]:
+      text.append('↓')
+    # Rising
+    elif a2[n] == 1 and a2_next == 2:
+      text.append('↑')
+  return ''.join(text)
+
+
 def japanese_to_romaji_with_accent(text):
   '''Reference https://r9y9.github.io/ttslearn/latest/notebooks/ch10_Recipe-Tacotron.html'''
+  _require('pyopenjtalk')
+  _require('unidecode')
   sentences = re.split(_japanese_marks, text)
   marks = re.findall(_japanese_marks, text)
   text = ''
@@ -231,45 +448,18 @@ def japanese_to_romaji_with_accent(text):
     if re.match(_japanese_characters, sentence):
       if text!='':
         text+=' '
-      labels = pyopenjtalk.extract_fullcontext(sentence)
-      for n, label in enumerate(labels):
-        phoneme = re.search(r'\-([^\+]*)\+', label).group(1)
-        if phoneme not in ['sil','pau']:
-          text += phoneme.replace('ch','ʧ').replace('sh','ʃ').replace('cl','Q')
-        else:
-          continue
-        n_moras = int(re.search(r'/F:(\d+)_', label).group(1))
-        a1 = int(re.search(r"/A:(\-?[0-9]+)\+", label).group(1))
-        a2 = int(re.search(r"\+(\d+)\+", label).group(1))
-        a3 = int(re.search(r"\+(\d+)/", label).group(1))
-        if re.search(r'\-([^\+]*)\+', labels[n + 1]).group(1) in ['sil','pau']:
-          a2_next=-1
-        else:
-          a2_next = int(re.search(r"\+(\d+)\+", labels[n + 1]).group(1))
-        # Accent phrase boundary
-        if a3 == 1 and a2_next == 1:
-          text += ' '
-        # Falling
-        elif a1 == 0 and a2_next == a2 + 1 and a2 != n_moras:
-          text += '↓'
-        # Rising
-        elif a2 == 1 and a2_next == 2:
-          text += '↑'
+      text += _labels_to_romaji(pyopenjtalk.extract_fullcontext(sentence))
     if i<len(marks):
       text += unidecode(marks[i]).replace(' ','')
   return text
 
 
 def latin_to_hangul(text):
-  for regex, replacement in _latin_to_hangul:
-    text = re.sub(regex, replacement, text)
-  return text
+  return _latin_to_hangul_replacer(text)
 
 
 def divide_hangul(text):
-  for regex, replacement in _hangul_divided:
-    text = re.sub(regex, replacement, text)
-  return text
+  return _hangul_divided_replacer(text)
 
 
 def hangul_number(num, sino=True):
@@ -370,6 +560,7 @@ def number_to_hangul(text):
 
 
 def number_to_chinese(text):
+  _require('cn2an')
   numbers = re.findall(r'\d+(?:\.?\d+)?', text)
   for number in numbers:
     text = text.replace(number, cn2an.an2cn(number),1)
@@ -377,6 +568,8 @@ def number_to_chinese(text):
 
 
 def chinese_to_bopomofo(text):
+  _require('jieba')
+  _require('pypinyin')
   text=text.replace('、','，').replace('；','，').replace('：','，')
   words=jieba.lcut(text,cut_all=False)
   text=''
@@ -395,15 +588,11 @@ def chinese_to_bopomofo(text):
 
 
 def latin_to_bopomofo(text):
-  for regex, replacement in _latin_to_bopomofo:
-    text = re.sub(regex, replacement, text)
-  return text
+  return _latin_to_bopomofo_replacer(text)
 
 
 def bopomofo_to_romaji(text):
-  for regex, replacement in _bopomofo_to_romaji:
-    text = re.sub(regex, replacement, text)
-  return text
+  return _bopomofo_to_romaji_replacer(text)
 
 
 def basic_cleaners(text):
@@ -434,6 +623,7 @@ def japanese_cleaners2(text):
 
 def korean_cleaners(text):
   '''Pipeline for Korean text'''
+  _require('jamo')
   text = latin_to_hangul(text)
   text = number_to_hangul(text)
   text = j2hcj(h2j(text))
@@ -453,23 +643,51 @@ def chinese_cleaners(text):
   return text
 
 
+_chinese_segment_re = re.compile(r'\[ZH\].*?\[ZH\]')
+_japanese_segment_re = re.compile(r'\[JA\].*?\[JA\]')
+_glide_re = re.compile('i[aoe]|u[aoəe]')
+_retroflex_re = re.compile('([ʦsɹ]`[⁼ʰ]?)([→↓↑]+)|([ʦs][⁼ʰ]?)([→↓↑]+)')
+
+
+def _clean_chinese_segment(text):
+  text=number_to_chinese(text)
+  text=chinese_to_bopomofo(text)
+  text=latin_to_bopomofo(text)
+  text=bopomofo_to_romaji(text)
+  # i/u glides and the retroflex/dental vowels, each as one pass; neither pattern can match what the other writes
+  text=_glide_re.sub(lambda x:('y' if x.group(0)[0]=='i' else 'w')+x.group(0)[1:],text)
+  text=_retroflex_re.sub(lambda x:x.group(1)+'ɹ`'+x.group(2) if x.group(1) else x.group(3)+'ɹ'+x.group(4),text)
+  return text.replace('ɻ','ɹ`')
+
+
+def _clean_japanese_segment(text):
+  return japanese_to_romaji_with_accent(text).replace('ts','ʦ').replace('u','ɯ').replace('...','…')
+
+
 def zh_ja_mixture_cleaners(text):
-  chinese_texts=re.findall(r'\[ZH\].*?\[ZH\]',text)
-  japanese_texts=re.findall(r'\[JA\].*?\[JA\]',text)
-  for chinese_text in chinese_texts:
-    cleaned_text=number_to_chinese(chinese_text[4:-4])
-    cleaned_text=chinese_to_bopomofo(cleaned_text)
-    cleaned_text=latin_to_bopomofo(cleaned_text)
-    cleaned_text=bopomofo_to_romaji(cleaned_text)
-    cleaned_text=re.sub('i[aoe]',lambda x:'y'+x.group(0)[1:],cleaned_text)
-    cleaned_text=re.sub('u[aoəe]',lambda x:'w'+x.group(0)[1:],cleaned_text)
-    cleaned_text=re.sub('([ʦsɹ]`[⁼ʰ]?)([→↓↑]+)',lambda x:x.group(1)+'ɹ`'+x.group(2),cleaned_text).replace('ɻ','ɹ`')
-    cleaned_text=re.sub('([ʦs][⁼ʰ]?)([→↓↑]+)',lambda x:x.group(1)+'ɹ'+x.group(2),cleaned_text)
-    text = text.replace(chinese_text,cleaned_text+' ',1)
-  for japanese_text in japanese_texts:
-    cleaned_text=japanese_to_romaji_with_accent(japanese_text[4:-4]).replace('ts','ʦ').replace('u','ɯ').replace('...','…')
-    text = text.replace(japanese_text,cleaned_text+' ',1)
+  chinese_segments=list(_chinese_segment_re.finditer(text))
+  japanese_segments=list(_japanese_segment_re.finditer(text))
+  segments=sorted(chinese_segments+japanese_segments,key=lambda x:x.start())
+  if all(a.end()<=b.start() for a,b in zip(segments,segments[1:])):
+    # Rebuild the text once instead of a str.replace over the whole text per segment
+    pieces=[]
+    pos=0
+    for segment in segments:
+      pieces.append(text[pos:segment.start()])
+      if segment.re is _chinese_segment_re:
+        pieces.append(_clean_chinese_segment(segment.group(0)[4:-4])+' ')
+      else:
+        pieces.append(_clean_japanese_segment(segment.group(0)[4:-4])+' ')
+      pos=segment.end()
+    pieces.append(text[pos:])
+    text=''.join(pieces)
+  else:
+    # Interleaved tags such as [JA]..[ZH]..[JA]..[ZH]: keep the original replacement order
+    for chinese_text in [x.group(0) for x in chinese_segments]:
+      text = text.replace(chinese_text,_clean_chinese_segment(chinese_text[4:-4])+' ',1)
+    for japanese_text in [x.group(0) for x in japanese_segments]:
+      text = text.replace(japanese_text,_clean_japanese_segment(japanese_text[4:-4])+' ',1)
   text=text[:-1]
   if len(text) and re.match('[A-Za-zɯɹəɥ→↓↑]',text[-1]):
     text += '.'
-  return text
\ No newline at end of file
+  return text
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# 文本前端（清洗 + 转音素 id）结果的缓存，内存中按 LRU 保留最近使用的条目，可选的 sqlite 文件在重启后仍然有效
+# key 由原始文本、cleaner 名称和符号表的哈希组成，换了 cleaner 或符号表的模型不会读到旧的结果
+# sqlite 的写入攒够 commit_every 条或关闭时才提交，超过 max_rows 条时删除最久未使用的
+# 示例用法
+# cache = TextCache(max_entries=1024, path='cache/text_cache.db')
+# sequence, clean_text = cache.get(text, hps.symbols, hps.data.text_cleaners, text_to_sequence)
+# print(cache.stats())
+class TextCache:
+    def __init__(self, max_entries=1024, path=None, max_rows=100000, commit_every=32):
+        """
+        :param max_entries: 内存中最多保留的条目数
+        :param path: sqlite 文件路径，None 时只使用内存
+        :param max_rows: sqlite 中最多保留的条目数
+        :param commit_every: 每写入多少条提交一次，未提交的条目在进程崩溃时丢失，不影响正确性
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.max_rows = max_rows
+        self.commit_every = commit_every
+        # 未提交的写入条数，以及在内存中命中、待写回 sqlite 的最近使用时间 {key: time}
+        self.pending = 0
+        self.touched = {}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # WAL 下 synchronous=NORMAL 提交时不再 fsync，崩溃最多丢失最近的提交
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS text_cache (key TEXT PRIMARY KEY, sequence TEXT, '
+                            'clean_text TEXT)')
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(text_cache)')]
+            if 'last_used' not in columns:
+                self.db.execute('ALTER TABLE text_cache ADD COLUMN last_used REAL DEFAULT 0')
+            self.db.execute('CREATE INDEX IF NOT EXISTS text_cache_last_used ON text_cache (last_used)')
+            self.db.commit()
+            self.rows = self.db.execute('SELECT COUNT(*) FROM text_cache').fetchone()[0]
+
+    @staticmethod
+    def make_key(text, symbols, cleaner_names):
+        h = hashlib.sha1()
+        for part in (text, '\x1f'.join(cleaner_names), '\x1f'.join(symbols)):
+            h.update(part.encode('utf-8'))
+            h.update(b'\x1e')
+        return h.hexdigest()
+
+    def get(self, text, symbols, cleaner_names, compute):
+        """
+        :param compute: 未命中时调用 compute(text, symbols, cleaner_names)，返回 (sequence, clean_text)
+        :return: (sequence, clean_text)，sequence 是新的 list，调用方可以修改
+        """
+        key = self.make_key(text, symbols, cleaner_names)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if self.db is not None:
+                    self.touched[key] = time.time()
+                return list(entry[0]), entry[1]
+            if self.db is not None:
+                row = self.db.execute('SELECT sequence, clean_text FROM text_cache WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    entry = (tuple(json.loads(row[0])), row[1])
+                    self._put(key, entry)
+                    self.touched[key] = time.time()
+                    self.disk_hits += 1
+                    return list(entry[0]), entry[1]
+            self.misses += 1
+        # 文本清洗较慢，不在锁内执行
+        sequence, clean_text = compute(text, symbols, cleaner_names)
+        entry = (tuple(sequence), clean_text)
+        with self.lock:
+            self._put(key, entry)
+            if self.db is not None:
+                try:
+                    self.db.execute('INSERT OR REPLACE INTO text_cache (key, sequence, clean_text, last_used) '
+                                    'VALUES (?, ?, ?, ?)', (key, json.dumps(entry[0]), clean_text, time.time()))
+                    self.rows += 1
+                    self.pending += 1
+                    if self.pending >= self.commit_every:
+                        self._flush()
+                except sqlite3.Error:
+                    # 磁盘缓存写入失败不影响合成
+                    logging.exception('failed to write text cache')
+        return list(sequence), clean_text
+
+    def _flush(self):
+        """
+        写回最近使用时间、删除超出 max_rows 的条目并提交，调用方持有锁
+        """
+        if self.touched:
+            self.db.executemany('UPDATE text_cache SET last_used = ? WHERE key = ?',
+                                [(t, key) for key, t in self.touched.items()])
+            self.touched.clear()
+        if self.max_rows is not None and self.rows > self.max_rows:
+            self.db.execute('DELETE FROM text_cache WHERE key IN '
+                            '(SELECT key FROM text_cache ORDER BY last_used LIMIT ?)', (self.rows - self.max_rows,))
+            self.rows = self.db.execute('SELECT COUNT(*) FROM text_cache').fetchone()[0]
+        self.db.commit()
+        self.pending = 0
+
+    def contains(self, text, symbols, cleaner_names):
+        """
+        是否已缓存，不计入命中率，也不改变 LRU 顺序
+        """
+        key = self.make_key(text, symbols, cleaner_names)
+        with self.lock:
+            if key in self.entries:
+                return True
+            if self.db is not None:
+                return self.db.execute('SELECT 1 FROM text_cache WHERE key = ?', (key,)).fetchone() is not None
+        return False
+
+    def _put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM text_cache')
+                self.db.commit()
+                self.rows = 0
+                self.pending = 0
+                self.touched.clear()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                try:
+                    self._flush()
+                except sqlite3.Error:
+                    logging.exception('failed to flush text cache')
+                self.db.close()
+                self.db = None
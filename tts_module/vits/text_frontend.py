@@ -0,0 +1,112 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tts_module.vits.text import cleaners, get_encoder, _clean_text
+
+# 工作进程内的状态，由 _init_worker 设置
+_worker = {}
+
+
+def _init_worker(symbols, cleaner_names, shm_name, slot_size, jieba_cache_dir):
+    _worker['encoder'] = get_encoder(symbols)
+    _worker['cleaner_names'] = cleaner_names
+    _worker['shm'] = shared_memory.SharedMemory(name=shm_name)
+    _worker['slot_size'] = slot_size
+    # 提前加载 jieba、pypinyin 和 pyopenjtalk 的词典
+    try:
+        cleaners.warm_up(cleaner_names, jieba_cache_dir)
+    except Exception:
+        # 预热失败时第一次请求再加载，不影响使用
+        logging.exception('failed to warm up text frontend')
+
+
+def _encode(text, slot):
+    clean_text = _clean_text(text, _worker['cleaner_names'])
+    ids = _worker['encoder'].ids(clean_text)
+    if slot is None or len(ids) > _worker['slot_size']:
+        # 没有空闲的槽位或序列太长时随结果一起返回
+        return None, len(ids), ids, clean_text
+    offset = slot * _worker['slot_size'] * ids.itemsize
+    np.ndarray(len(ids), dtype=np.int64, buffer=_worker['shm'].buf, offset=offset)[:] = ids
+    return slot, len(ids), None, clean_text
+
+
+# 文本前端的进程池，分词、注音和正则替换在工作进程中完成，不占用推理线程的 GIL
+# 音素 id 写入共享内存中预先分配的槽位，主进程只复制出结果，不经过 pickle
+# 示例用法
+# pool = FrontendPool(hps.symbols, hps.data.text_cleaners, workers=2)
+# future = pool.submit('[ZH]你好[ZH]')  # 在上一段推理期间提交下一段
+# ids, clean_text = future.result()
+# pool.close()
+class FrontendPool:
+    def __init__(self, symbols, cleaner_names, workers=2, slots=16, slot_size=4096, jieba_cache_dir=None):
+        """
+        :param symbols: 模型的符号表
+        :param cleaner_names: 模型的 text_cleaners
+        :param workers: 工作进程数
+        :param slots: 共享内存的槽位数，即同时在处理中的文本数，槽位用完时结果改为随返回值传回
+        :param slot_size: 每个槽位能存放的 id 个数
+        :param jieba_cache_dir: jieba 前缀词典缓存的目录，见 cleaners.warm_up
+        """
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size * 8)
+        self.buffer = np.ndarray(slots * slot_size, dtype=np.int64, buffer=self.shm.buf)
+        self.free_slots = list(range(slots))
+        self.lock = threading.Lock()
+        # spawn 启动的进程不继承推理线程和 CUDA 的状态
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(tuple(symbols), list(cleaner_names), self.shm.name, slot_size,
+                                                      jieba_cache_dir))
+        # 提前启动全部工作进程并开始预热
+        for _ in range(workers):
+            self.executor.submit(int)
+
+    def submit(self, text):
+        """
+        :return: Future，结果为 (int64 数组, clean_text)
+        """
+        with self.lock:
+            slot = self.free_slots.pop() if self.free_slots else None
+        result = Future()
+        try:
+            future = self.executor.submit(_encode, text, slot)
+        except BaseException:
+            if slot is not None:
+                with self.lock:
+                    self.free_slots.append(slot)
+            raise
+        future.add_done_callback(lambda f: self._done(f, slot, result))
+        return result
+
+    def encode(self, text):
+        return self.submit(text).result()
+
+    def _done(self, future, slot, result):
+        try:
+            used_slot, length, ids, clean_text = future.result()
+            if used_slot is not None:
+                start = used_slot * self.slot_size
+                ids = self.buffer[start:start + length].copy()
+        except BaseException as e:
+            result.set_exception(e)
+        else:
+            result.set_result((ids, clean_text))
+        finally:
+            if slot is not None:
+                with self.lock:
+                    self.free_slots.append(slot)
+
+    def close(self, wait=True):
+        """
+        :param wait: 等待工作进程退出，进程池已损坏时可以不等待
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        del self.buffer
+        self.shm.close()
+        self.shm.unlink()
@@ -16,12 +16,18 @@ logger = logging
 
 def load_checkpoint(checkpoint_path, model, optimizer=None):
     assert os.path.isfile(checkpoint_path)
-    checkpoint_dict = torch.load(checkpoint_path, map_location='cuda')
+    checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
     iteration = checkpoint_dict['iteration']
     learning_rate = checkpoint_dict['learning_rate']
     if optimizer is not None:
         optimizer.load_state_dict(checkpoint_dict['optimizer'])
-    saved_state_dict = checkpoint_dict['model']
+    load_state_dict(model, checkpoint_dict['model'])
+    logger.info("Loaded checkpoint '{}' (iteration {})".format(
+        checkpoint_path, iteration))
+    return model, optimizer, learning_rate, iteration
+
+
+def load_state_dict(model, saved_state_dict):
     if hasattr(model, 'module'):
         state_dict = model.module.state_dict()
     else:
@@ -37,9 +43,34 @@ def load_checkpoint(checkpoint_path, model, optimizer=None):
         model.module.load_state_dict(new_state_dict)
     else:
         model.load_state_dict(new_state_dict)
-    logger.info("Loaded checkpoint '{}' (iteration {})".format(
-        checkpoint_path, iteration))
-    return model, optimizer, learning_rate, iteration
+
+
+def load_inference_checkpoint(checkpoint_path, model):
+    """
+    加载训练或推理 checkpoint，返回已经调用过 prepare_for_inference 的模型
+    """
+    assert os.path.isfile(checkpoint_path)
+    checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+    if checkpoint_dict.get('inference'):
+        # 推理 checkpoint 中已经没有 weight norm 的参数，需要先转换模型结构
+        model.prepare_for_inference()
+        load_state_dict(model, checkpoint_dict['model'])
+    else:
+        load_state_dict(model, checkpoint_dict['model'])
+        model.prepare_for_inference()
+    logger.info("Loaded checkpoint '{}' for inference".format(checkpoint_path))
+    return model
+
+
+def save_inference_checkpoint(model, checkpoint_path, half=False):
+    """
+    保存只含推理所需参数的 checkpoint
+    :param half: 浮点参数以 float16 保存，文件再小一半，加载时转回模型的精度
+    """
+    model.prepare_for_inference()
+    state_dict = {k: v.half() if half and v.is_floating_point() else v for k, v in model.state_dict().items()}
+    torch.save({'model': state_dict, 'inference': True, 'iteration': 0, 'learning_rate': 0}, checkpoint_path)
+    logger.info("Saved inference checkpoint to {}".format(checkpoint_path))
 
 
 def plot_spectrogram_to_numpy(spectrogram):
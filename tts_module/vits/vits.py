@@ -1,54 +1,412 @@
 # coding=utf-8
+import hashlib
+import itertools
 import json
+import logging
 import os.path
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
+import torch
 from torch import no_grad, LongTensor
 
-import tts_module.vits.commons as commons
 import tts_module.vits.utils as utils
+from tts_module.vits.compiled import CompiledSynthesizer
 from tts_module.vits.models import SynthesizerTrn
-from tts_module.vits.text import text_to_sequence, _clean_text
+from tts_module.vits.onnx_backend import OnnxSynthesizer
+from tts_module.vits.onnx_export import META_FILE, export_onnx, verify_onnx
+from tts_module.vits.onnx_quantize import CALIBRATION_TEXTS, collect_calibration_inputs, evaluate_quality, \
+    quantize_onnx
+from tts_module.vits.precision import resolve_policy
+from tts_module.vits.text import SymbolEncoder, cleaners, text_to_sequence, _clean_text
+from tts_module.vits.text_cache import TextCache
+from tts_module.vits.text_frontend import FrontendPool
+from tts_module.vits.wave_cache import WaveformCache
 
 
 class ViTs:
-    def __init__(self, config_path, models_info_path, models_path, device='cuda'):
+    def __init__(self, config_path, models_info_path, models_path, device='cuda', max_memory_mb=2048,
+                 backend='torch', onnx_dir=None, intra_op_threads=None, inter_op_threads=None, quantize=None,
+                 calibration_texts=None, precision='fp32', compiled=False,
+                 text_cache_size=1024, text_cache_path=None, seed=None, wave_cache_mb=64, wave_cache_dir=None,
+                 frontend_workers=0, jieba_cache_dir=None):
+        """
+        :param max_memory_mb: 常驻内存中模型参数的总大小上限，超出时卸载最久未使用的 checkpoint
+        :param backend: 'torch' 或 'onnx'，onnx 使用 onnxruntime 在 CPU 上推理，首次加载时自动导出并校验
+        :param onnx_dir: 导出的 onnx 模型存放目录，默认在 checkpoint 所在目录的 onnx 子目录
+        :param intra_op_threads: onnxruntime 单个算子内部的线程数
+        :param inter_op_threads: onnxruntime 算子之间并行的线程数
+        :param quantize: None、'dynamic' 或 'static'，把卷积和矩阵乘量化为 int8，只支持 onnx 后端
+        :param calibration_texts: 静态量化的校准语句，同时用于量化后的音质检查，默认 CALIBRATION_TEXTS
+        :param precision: 精度策略，见 PRECISION_POLICIES，如 'bf16' 让文本编码器和声码器在 bfloat16 下运行，
+                          设备不支持时回退到 fp32，只支持 torch 后端
+        :param compiled: 用 torch.compile 编译推理，加载时按各个长度预热编译，只支持 torch 后端
+        :param text_cache_size: 内存中缓存的文本前端结果条数，0 时不缓存
+        :param text_cache_path: 文本前端结果的 sqlite 缓存文件，重启后仍然有效
+        :param seed: 默认的随机种子，设置后相同的文本和参数总是合成相同的波形，并会缓存合成结果
+        :param wave_cache_mb: 内存中缓存的波形总大小，0 时不缓存
+        :param wave_cache_dir: 从内存淘汰的波形压缩后写入的目录
+        :param frontend_workers: 文本前端的工作进程数，大于 0 时文本清洗在独立的进程中完成，
+                                 可以用 prefetch_text 在上一段推理期间处理下一段
+        :param jieba_cache_dir: jieba 前缀词典缓存的目录，默认使用系统临时目录
+        """
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f'unknown backend: {backend}')
+        if quantize not in (None, 'dynamic', 'static'):
+            raise ValueError(f'unknown quantization mode: {quantize}')
+        if quantize is not None and backend != 'onnx':
+            raise ValueError("quantize requires backend='onnx'")
+        if precision != 'fp32' and backend != 'torch':
+            raise ValueError("precision policy requires backend='torch'")
+        if compiled and backend != 'torch':
+            raise ValueError("compiled requires backend='torch'")
+        self.compiled = compiled
+        self.quantize = quantize
+        self.calibration_texts = calibration_texts or CALIBRATION_TEXTS
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
         self.hps_ms = utils.get_hparams_from_file(config_path)
         self.models_info_path = models_info_path
         self.models_path = models_path
         with open(models_info_path, "r", encoding="utf-8") as f:
             self.models_info = json.load(f)
         self.model = None
-        self.device = device
+        # 当前角色的 checkpoint 标识（路径、修改时间和大小），重新训练的同名模型不会命中旧的波形缓存
+        self.checkpoint_id = None
+        # onnxruntime 后端只在 CPU 上运行
+        self.device = 'cpu' if backend == 'onnx' else device
+        # 多个线程共用同一个模型时串行推理
+        self.lock = threading.Lock()
+        # 已加载的网络 {checkpoint: (net_g_ms, 字节数)}，同一个 checkpoint 的多个角色共用一份，按最近使用排序
+        self.networks = OrderedDict()
+        self.max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb is not None else None
+        self.registry_lock = threading.RLock()
+        # 每个 checkpoint 一把加载锁，避免后台预加载和前台切换重复加载
+        self.loading_locks = {}
+        self.preload_executor = None
+        self.set_precision(precision)
+        # 常说的句子不用再跑一遍分词、注音和正则替换
+        self.text_cache = TextCache(text_cache_size, text_cache_path) if text_cache_size else None
+        self.seed = seed
+        self.wave_cache = WaveformCache(wave_cache_mb * 1024 * 1024, wave_cache_dir) if wave_cache_mb else None
+        # 只加载模型的 cleaner 用到的分词、注音库，在后台线程中预热，避免第一个请求时加载词典
+        # 启用文本前端进程池时由工作进程各自预热，当前进程不再加载
+        self.frontend_warmup = None
+        if not frontend_workers:
+            self.frontend_warmup = threading.Thread(target=self.warm_up_frontend, args=(jieba_cache_dir,),
+                                                    daemon=True)
+            self.frontend_warmup.start()
+        self.frontend = FrontendPool(self.hps_ms.symbols, self.hps_ms.data.text_cleaners, frontend_workers,
+                                     jieba_cache_dir=jieba_cache_dir) if frontend_workers else None
+        # 已提交给文本前端进程池的文本 {文本: Future}，按提交顺序排列
+        self.prefetched = OrderedDict()
+        self.prefetch_lock = threading.Lock()
 
-    def load_model(self, name):
+    def find_model_info(self, name):
+        """
+        :param name: 角色的中文名或英文名
+        :return: (models_info 中的 key, info)
+        """
         for i, info in self.models_info.items():
-            sid = info['sid']
-            name_en = info['name_en']
-            name_zh = info['name_zh']
-            if name_zh != name:
+            if name in (info['name_zh'], info['name_en']):
+                return i, info
+        raise KeyError(f'speaker not found: {name}')
+
+    def get_checkpoint_key(self, i, info):
+        # info 中可以用 checkpoint 字段让多个角色指向同一个多说话人 checkpoint
+        path = os.path.join(self.models_path, info.get('checkpoint', f'{i}/{i}.pth'))
+        return os.path.realpath(path), info['type']
+
+    def load_model(self, name):
+        """
+        切换到指定角色，checkpoint 已在内存中时只需切换 sid
+        """
+        i, info = self.find_model_info(name)
+        key = self.get_checkpoint_key(i, info)
+        net_g_ms = self.get_network(key)
+        source = self.checkpoint_source(key[0])
+        self.checkpoint_id = f"{source['path']}:{source['mtime_ns']}:{source['size']}"
+        sid = info['sid']
+        self.model = (
+            sid, info['name_en'], info['name_zh'], info['title'], f"{self.models_path}/{i}/{info['cover']}",
+            info['example'], info['language'], net_g_ms, self.create_tts_fn(net_g_ms, sid),
+            self.create_to_symbol_fn(self.hps_ms))
+
+    def get_network(self, key):
+        with self.registry_lock:
+            if key in self.networks:
+                self.networks.move_to_end(key)
+                return self.networks[key][0]
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+        with loading_lock:
+            with self.registry_lock:
+                # 等锁期间可能已被其他线程加载
+                if key in self.networks:
+                    self.networks.move_to_end(key)
+                    return self.networks[key][0]
+            net_g_ms = self.load_network(*key)
+            if isinstance(net_g_ms, OnnxSynthesizer):
+                size = net_g_ms.memory_size
+            else:
+                net_g_ms.set_precision_policy(self.bf16_modules)
+                size = sum(t.numel() * t.element_size() for t in itertools.chain(net_g_ms.parameters(),
+                                                                                 net_g_ms.buffers()))
+            with self.registry_lock:
+                self.networks[key] = (net_g_ms, size)
+                self.evict_networks()
+        return net_g_ms
+
+    def load_network(self, checkpoint_path, model_type):
+        t1 = time.perf_counter()
+        if self.backend == 'onnx':
+            net_g_ms = self.load_onnx_network(checkpoint_path, model_type)
+        else:
+            net_g_ms = self.create_network(checkpoint_path, model_type).to(self.device)
+            if self.compiled:
+                net_g_ms = CompiledSynthesizer(net_g_ms).warmup()
+        logging.info(f'loaded {checkpoint_path} ({self.backend}) in {time.perf_counter() - t1:.2f}s')
+        return net_g_ms
+
+    def create_network(self, checkpoint_path, model_type):
+        net_g_ms = SynthesizerTrn(
+            len(self.hps_ms.symbols),
+            self.hps_ms.data.filter_length // 2 + 1,
+            self.hps_ms.train.segment_size // self.hps_ms.data.hop_length,
+            n_speakers=self.hps_ms.data.n_speakers if model_type == "multi" else 0,
+            **self.hps_ms.model)
+        # 合并 weight norm 并去掉推理用不到的模块
+        utils.load_inference_checkpoint(checkpoint_path, net_g_ms)
+        return net_g_ms
+
+    @staticmethod
+    def checkpoint_source(checkpoint_path):
+        """
+        :return: checkpoint 的路径、修改时间和大小，用于判断导出和缓存的结果是否来自同一个 checkpoint
+        """
+        stat = os.stat(checkpoint_path)
+        return {'path': os.path.realpath(checkpoint_path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+    @staticmethod
+    def read_meta(model_dir):
+        try:
+            with open(os.path.join(model_dir, META_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_onnx_network(self, checkpoint_path, model_type):
+        source = self.checkpoint_source(checkpoint_path)
+        # 目录名带上路径的哈希，不同目录下同名的 checkpoint 不会共用导出结果
+        name = os.path.splitext(os.path.basename(checkpoint_path))[0]
+        name = f"{name}-{hashlib.sha1(source['path'].encode('utf-8')).hexdigest()[:8]}"
+        if self.onnx_dir is not None:
+            model_dir = os.path.join(self.onnx_dir, name)
+        else:
+            model_dir = os.path.join(os.path.dirname(checkpoint_path), 'onnx', name)
+        meta_path = os.path.join(model_dir, META_FILE)
+        # 没有导出过或 meta 中记录的 checkpoint 与当前的不一致时重新导出
+        meta = self.read_meta(model_dir)
+        if meta is None or meta.get('source') != source:
+            if meta is not None:
+                logging.info(f'onnx model in {model_dir} was exported from another checkpoint, re-exporting')
+            net_g_ms = self.create_network(checkpoint_path, model_type)
+            export_onnx(net_g_ms, model_dir, source=source)
+            onnx_net = OnnxSynthesizer(model_dir, self.intra_op_threads, self.inter_op_threads)
+            try:
+                verify_onnx(net_g_ms, onnx_net, [torch.randint(1, len(self.hps_ms.symbols), (length,))
+                                                 for length in (16, 64, 160)])
+            except ValueError:
+                # 校验失败时删除导出结果，下次重新导出
+                os.remove(meta_path)
+                raise
+        if self.quantize is not None:
+            model_dir = self.quantize_onnx_network(model_dir, model_type)
+        return OnnxSynthesizer(model_dir, self.intra_op_threads, self.inter_op_threads)
+
+    def quantize_onnx_network(self, model_dir, model_type):
+        """
+        量化导出的 fp32 模型，并用校准语句比较量化前后的对数谱距离
+        :return: 量化模型的目录
+        """
+        quant_dir = f'{model_dir}-int8-{self.quantize}'
+        quant_meta_path = os.path.join(quant_dir, META_FILE)
+        # 校准语句决定了静态量化的量化参数和 meta 中的音质检查结果，换了语句需要重新量化
+        calibration = hashlib.sha1('\n'.join(self.calibration_texts).encode('utf-8')).hexdigest()
+        meta = self.read_meta(quant_dir)
+        if meta is not None and meta.get('source') == self.read_meta(model_dir).get('source') and \
+                meta.get('calibration') == calibration:
+            return quant_dir
+        sequences = self.calibration_sequences()
+        sid = LongTensor([0]) if model_type == 'multi' else None
+        calibration_inputs = collect_calibration_inputs(model_dir, sequences, sid) \
+            if self.quantize == 'static' else None
+        quantize_onnx(model_dir, quant_dir, self.quantize, calibration_inputs)
+        quality = evaluate_quality(OnnxSynthesizer(model_dir), OnnxSynthesizer(quant_dir), sequences, sid)
+        logging.info(f"{self.quantize} int8 quality: log-spectral distance mean {quality['lsd_mean']:.2f} dB, "
+                     f"max {quality['lsd_max']:.2f} dB")
+        # 检查结果一并写入 meta，之后可以直接查看
+        with open(quant_meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        meta['quality'] = quality
+        meta['calibration'] = calibration
+        with open(quant_meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return quant_dir
+
+    def calibration_sequences(self):
+        sequences = []
+        for text in self.calibration_texts:
+            try:
+                sequences.append(self.get_text(text, self.hps_ms, False)[0])
+            except Exception:
+                # 缺少某种语言的文本处理依赖时跳过这条
+                logging.exception(f'failed to clean calibration text: {text}')
+        if not sequences:
+            # 全部失败时用随机序列校准，只能保证数值范围大致正确
+            logging.warning('no calibration text available, using random sequences')
+            sequences = [torch.randint(1, len(self.hps_ms.symbols), (length,)) for length in (16, 64, 160)]
+        return sequences
+
+    def evict_networks(self):
+        # 超出内存上限时按最近使用顺序卸载，当前使用的和最新加载的保留
+        if self.max_memory is None:
+            return
+        current = self.model[7] if self.model is not None else None
+        for key in list(self.networks)[:-1]:
+            if sum(size for _, size in self.networks.values()) <= self.max_memory:
+                break
+            if self.networks[key][0] is current:
                 continue
-            title = info['title']
-            cover = f"{self.models_path}/{i}/{info['cover']}"
-            example = info['example']
-            language = info['language']
-            net_g_ms = SynthesizerTrn(
-                len(self.hps_ms.symbols),
-                self.hps_ms.data.filter_length // 2 + 1,
-                self.hps_ms.train.segment_size // self.hps_ms.data.hop_length,
-                n_speakers=self.hps_ms.data.n_speakers if info['type'] == "multi" else 0,
-                **self.hps_ms.model)
-            utils.load_checkpoint(f'{self.models_path}/{i}/{i}.pth', net_g_ms, None)
-            net_g_ms = net_g_ms.eval().to(self.device)
-            self.model = (
-                sid, name_en, name_zh, title, cover, example, language, net_g_ms, self.create_tts_fn(net_g_ms, sid),
-                self.create_to_symbol_fn(self.hps_ms))
+            del self.networks[key]
+            logging.info(f'unloaded {key[0]}')
+
+    def set_precision(self, precision, force=False):
+        """
+        切换精度策略，对已加载的网络立即生效
+        :param force: 设备不支持 bfloat16 时也使用，只用于测试
+        """
+        self.precision = precision
+        self.bf16_modules = resolve_policy(precision, self.device, force)
+        with self.registry_lock:
+            for net_g_ms, _ in self.networks.values():
+                if not isinstance(net_g_ms, OnnxSynthesizer):
+                    net_g_ms.set_precision_policy(self.bf16_modules)
+
+    def preload(self, names):
+        """
+        在后台线程中预加载角色所在的 checkpoint，之后切换到这些角色不需要再读取文件
+        :return: 每个角色对应的 Future
+        """
+        with self.registry_lock:
+            if self.preload_executor is None:
+                self.preload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ViTsPreload')
+        futures = []
+        for name in names:
+            i, info = self.find_model_info(name)
+            futures.append(self.preload_executor.submit(self.get_network, self.get_checkpoint_key(i, info)))
+        return futures
+
+    def save_inference_checkpoint(self, name, path, half=False):
+        """
+        把角色所在的 checkpoint 另存为推理 checkpoint，info 的 checkpoint 字段指向它即可直接加载
+        """
+        i, info = self.find_model_info(name)
+        net_g_ms = self.get_network(self.get_checkpoint_key(i, info))
+        with self.lock:
+            utils.save_inference_checkpoint(net_g_ms, path, half=half)
+
+    def loaded_checkpoints(self):
+        with self.registry_lock:
+            return [key[0] for key in self.networks]
+
+    def warm_up_frontend(self, jieba_cache_dir=None):
+        t1 = time.perf_counter()
+        try:
+            cleaners.warm_up(self.hps_ms.data.text_cleaners, jieba_cache_dir)
+        except Exception:
+            # 预热失败时第一次请求再加载
+            logging.exception('failed to warm up text cleaners')
+            return
+        logging.info(f'text cleaners warmed up in {time.perf_counter() - t1:.2f}s')
+
+    def wait_frontend_warmup(self):
+        # 在当前进程中处理文本前等预热结束，避免与预热线程同时加载词典、写 jieba 的缓存文件
+        warmup = self.frontend_warmup
+        if warmup is not None:
+            warmup.join()
+
+    def prefetch_text(self, text):
+        """
+        把文本提交给文本前端进程池，之后合成这段文本时直接取结果，不启用进程池时什么也不做
+        :param text: 与传给 generate_speech 的文本相同
+        """
+        frontend = self.frontend
+        if frontend is None:
+            return
+        text = text.replace('\n', ' ').replace('\r', '').replace(' ', '')
+        # 已缓存的文本不用再处理
+        if self.text_cache is not None and self.text_cache.contains(text, self.hps_ms.symbols,
+                                                                    self.hps_ms.data.text_cleaners):
+            return
+        with self.prefetch_lock:
+            if text in self.prefetched:
+                return
+            try:
+                self.prefetched[text] = frontend.submit(text)
+            except BrokenProcessPool:
+                self.disable_frontend(frontend)
+                return
+            # 提交后没有合成的文本不一直保留
+            while len(self.prefetched) > 64:
+                self.prefetched.popitem(last=False)
+
+    def frontend_sequence(self, text, symbols, cleaner_names):
+        frontend = self.frontend
+        with self.prefetch_lock:
+            future = self.prefetched.pop(text, None)
+        try:
+            if future is None:
+                if frontend is None:
+                    return text_to_sequence(text, symbols, cleaner_names)
+                future = frontend.submit(text)
+            ids, clean_text = future.result()
+        except BrokenProcessPool:
+            self.disable_frontend(frontend)
+            return text_to_sequence(text, symbols, cleaner_names)
+        return ids.tolist(), clean_text
+
+    def disable_frontend(self, frontend):
+        """
+        工作进程异常退出后进程池不能再使用，改为在当前进程中处理文本
+        """
+        with self.prefetch_lock:
+            if frontend is None or self.frontend is not frontend:
+                return
+            logging.exception('text frontend pool is broken, falling back to in-process text cleaning')
+            self.frontend = None
+            self.prefetched.clear()
+        frontend.close(wait=False)
 
     def get_text(self, text, hps, is_symbol):
-        text_norm, clean_text = text_to_sequence(text, hps.symbols, [] if is_symbol else hps.data.text_cleaners)
-        if hps.data.add_blank:
-            text_norm = commons.intersperse(text_norm, 0)
-        text_norm = LongTensor(text_norm)
+        cleaner_names = [] if is_symbol else hps.data.text_cleaners
+        compute = text_to_sequence
+        if self.frontend is not None and not is_symbol and hps is self.hps_ms:
+            compute = self.frontend_sequence
+        elif not is_symbol:
+            self.wait_frontend_warmup()
+        if self.text_cache is not None:
+            text_norm, clean_text = self.text_cache.get(text, hps.symbols, cleaner_names, compute)
+        else:
+            text_norm, clean_text = compute(text, hps.symbols, cleaner_names)
+        # 插入 blank 和转换为张量都在 numpy 中一次完成
+        text_norm = SymbolEncoder.from_ids(text_norm, hps.data.add_blank)
         return text_norm, clean_text
 
     def create_tts_fn(self, net_g_ms, speaker_id):
@@ -82,7 +440,10 @@ class ViTs:
                 clean_text = f'[JA]{input_text}[JA]'
             else:
                 clean_text = input_text
-            return _clean_text(clean_text, hps.data.text_cleaners) if is_symbol_input else ''
+            if not is_symbol_input:
+                return ''
+            self.wait_frontend_warmup()
+            return _clean_text(clean_text, hps.data.text_cleaners)
 
         return to_symbol_fn
 
@@ -94,11 +455,128 @@ class ViTs:
         else:
             return 0.6, 0.668, 1
 
+    @contextmanager
+    def seeded(self, seed):
+        """
+        在固定的随机种子下推理，不影响全局的随机数状态
+        """
+        if seed is None:
+            yield
+            return
+        device = torch.device(self.device)
+        devices = [device.index or 0] if device.type == 'cuda' else []
+        with torch.random.fork_rng(devices=devices):
+            torch.manual_seed(seed)
+            yield
+
+    def wave_cache_key(self, text, ns, nsw, ls, seed):
+        sid, name_en, name_zh, title, cover, example, language, net_g_ms, tts_fn, to_symbol_fn = self.model
+        text = text.replace('\n', ' ').replace('\r', '').replace(' ', '')
+        # 推理后端、精度和是否编译不同时输出也不同，编译后的时长预测器按补齐后的长度采样噪声
+        variant = f'{self.backend}/{self.quantize}/{self.precision}/{self.compiled}'
+        return WaveformCache.make_key(text, f'{name_en}:{sid}:{self.checkpoint_id}', ns, nsw, ls, seed, variant)
+
     # sample_rate = 22050
-    def generate_speech(self, text, ns=0.6, nsw=0.668, ls=0.95):
+    def generate_speech(self, text, ns=0.6, nsw=0.668, ls=0.95, seed=None):
+        """
+        :param seed: 随机种子，None 时使用构造时的 seed；有种子时结果可复现并会被缓存
+        """
         lang = 2
         symbol_input = False
         sid, name_en, name_zh, title, cover, example, language, net_g_ms, tts_fn, to_symbol_fn = self.model
-        o1, o2 = tts_fn(text, lang, ns, nsw, ls, symbol_input)
-        wav = np.array(o2[1])
+        seed = self.seed if seed is None else seed
+        key = None
+        if seed is not None and self.wave_cache is not None:
+            key = self.wave_cache_key(text, ns, nsw, ls, seed)
+            wav = self.wave_cache.get(key)
+            if wav is not None:
+                return wav
+        with self.lock, self.seeded(seed):
+            o1, o2 = tts_fn(text, lang, ns, nsw, ls, symbol_input)
+        # float32 数组，不再复制
+        wav = np.asarray(o2[1])
+        if key is not None:
+            self.wave_cache.put(key, wav)
         return wav
+
+    def generate_speech_stream(self, text, ns=0.6, nsw=0.668, ls=0.95, chunk_frames=32, cancelled=None):
+        """
+        与 generate_speech 相同，但声码器分窗口解码，每解码完一个窗口就返回一段波形
+        :param chunk_frames: 每段的帧数，22050 采样率下 32 帧约 0.37 秒
+        :param cancelled: 取消标志 threading.Event，每个窗口之间检查
+        :return: 生成器，依次产出 float32 数组
+        """
+        sid, name_en, name_zh, title, cover, example, language, net_g_ms, tts_fn, to_symbol_fn = self.model
+        stn_tst, clean_text = self.get_text(text.replace('\n', ' ').replace('\r', '').replace(" ", ""), self.hps_ms,
+                                            False)
+        x_tst = stn_tst.unsqueeze(0).to(self.device)
+        x_tst_lengths = LongTensor([stn_tst.size(0)]).to(self.device)
+        chunks = net_g_ms.infer_stream(x_tst, x_tst_lengths, sid=LongTensor([sid]).to(self.device),
+                                       noise_scale=ns, noise_scale_w=nsw, length_scale=ls,
+                                       chunk_frames=chunk_frames)
+        while cancelled is None or not cancelled.is_set():
+            # 每个窗口单独加锁并关闭梯度，不在 yield 期间占用模型，也不把梯度开关留给调用方的线程
+            with self.lock, no_grad():
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            yield chunk.data.cpu().float().numpy()
+
+    def generate_speech_batch(self, texts, ns=0.6, nsw=0.668, ls=0.95, max_batch=8, seed=None, cancelled=None):
+        """
+        多段文本合并成一个 batch 推理，按长度排序后把长度相近的分为一组以减少 padding
+        :param texts: 带 [ZH]/[JA] 标签的文本列表
+        :param ls: 语速，可以是与 texts 一一对应的列表
+        :param max_batch: 每次前向最多的段数
+        :param seed: 随机种子，None 时使用构造时的 seed；有种子时先查 generate_speech 缓存的波形，
+                     其余的整批在该种子下合成，同样的输入得到同样的结果，但不写入缓存（与单独合成的结果不同）
+        :param cancelled: 取消标志 threading.Event，每组之间检查，取消后未合成的段为空数组
+        :return: 与 texts 顺序一致的 float32 数组列表
+        """
+        if not texts:
+            return []
+        if not isinstance(ls, (list, tuple)):
+            ls = [ls] * len(texts)
+        sid, name_en, name_zh, title, cover, example, language, net_g_ms, tts_fn, to_symbol_fn = self.model
+        seed = self.seed if seed is None else seed
+        wavs = [None] * len(texts)
+        if seed is not None and self.wave_cache is not None:
+            for i, text in enumerate(texts):
+                wavs[i] = self.wave_cache.get(self.wave_cache_key(text, ns, nsw, ls[i], seed))
+        pending = [i for i in range(len(texts)) if wavs[i] is None]
+        # 启用文本前端进程池时各段并行处理
+        for i in pending:
+            self.prefetch_text(texts[i])
+        # 与 tts_fn 相同的文本预处理
+        seqs = {i: self.get_text(texts[i].replace('\n', ' ').replace('\r', '').replace(' ', ''), self.hps_ms,
+                                 False)[0] for i in pending}
+        order = sorted(pending, key=lambda i: seqs[i].size(0), reverse=True)
+        # 长度不到组内最长一半的另起一组，避免短句补齐到长句的长度
+        batches = []
+        for i in order:
+            if batches and len(batches[-1]) < max_batch and seqs[i].size(0) * 2 >= seqs[batches[-1][0]].size(0):
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+        hop_length = self.hps_ms.data.hop_length
+        for batch in batches:
+            if cancelled is not None and cancelled.is_set():
+                for i in batch:
+                    wavs[i] = np.zeros(0, dtype=np.float32)
+                continue
+            x_lengths = LongTensor([seqs[i].size(0) for i in batch])
+            x = torch.zeros(len(batch), int(x_lengths.max()), dtype=torch.long)
+            for row, i in enumerate(batch):
+                x[row, :seqs[i].size(0)] = seqs[i]
+            with no_grad(), self.lock, self.seeded(seed):
+                o, attn, y_mask, _ = net_g_ms.infer(x.to(self.device), x_lengths.to(self.device),
+                                                    sid=LongTensor([sid] * len(batch)).to(self.device),
+                                                    noise_scale=ns, noise_scale_w=nsw,
+                                                    length_scale=torch.FloatTensor([ls[i] for i in batch]).to(
+                                                        self.device))
+                audio = o[:, 0].data.cpu().float().numpy()
+                # 按 y_mask 去掉 padding 部分生成的音频
+                y_lengths = y_mask.sum([1, 2]).long().cpu().numpy() * hop_length
+            for row, i in enumerate(batch):
+                wavs[i] = audio[row, :y_lengths[row]]
+        return wavs
@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+# 合成结果的缓存，问候语、应答词等常说的句子直接返回上次的波形
+# 内存中按总字节数 LRU 淘汰，指定 spill_dir 时被淘汰的波形压缩成 16 bit PCM 写入磁盘，之后命中时再读回
+# 只有固定了随机种子的合成结果才是可复现的，调用方只应缓存带 seed 的结果
+# 示例用法
+# cache = WaveformCache(max_bytes=64 * 1024 * 1024, spill_dir='cache/wave')
+# key = cache.make_key('[ZH]你好[ZH]', 'alice', 0.6, 0.668, 0.95, seed=0)
+# wav = cache.get(key)
+# if wav is None:
+#     cache.put(key, synthesize())
+class WaveformCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None, max_spill_bytes=512 * 1024 * 1024):
+        """
+        :param max_bytes: 内存中波形的总字节数上限
+        :param spill_dir: 被淘汰的波形写入的目录，None 时直接丢弃
+        :param max_spill_bytes: 磁盘上的总字节数上限，超出时删除最早写入的文件
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # 磁盘上的文件 {路径: 字节数}，按写入时间排序
+        self.spill_files = OrderedDict()
+        self.spill_size = 0
+        self.spill_lock = threading.Lock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._scan_spill()
+
+    @staticmethod
+    def make_key(text, speaker, ns, nsw, ls, seed, variant=''):
+        """
+        :param text: 已规范化的文本
+        :param speaker: 角色及模型的标识
+        :param variant: 影响输出的其他设置，如推理后端和精度
+        """
+        h = hashlib.sha1()
+        h.update(repr((text, speaker, float(ns), float(nsw), float(ls), int(seed), variant)).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        :return: float32 数组的副本，未命中时返回 None
+        """
+        with self.lock:
+            wav = self.entries.get(key)
+            if wav is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return wav.copy()
+        wav = self._load(key)
+        with self.lock:
+            if wav is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            evicted = self._put(key, wav)
+        self._spill(evicted)
+        return wav.copy()
+
+    def put(self, key, wav):
+        wav = np.array(wav, dtype=np.float32)
+        with self.lock:
+            evicted = self._put(key, wav)
+        self._spill(evicted)
+
+    def _put(self, key, wav):
+        """
+        :return: 被淘汰的 [(key, wav)]，由调用方在锁外写入磁盘
+        """
+        if key in self.entries:
+            self.size -= self.entries.pop(key).nbytes
+        self.entries[key] = wav
+        self.size += wav.nbytes
+        evicted = []
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            old_key, old_wav = self.entries.popitem(last=False)
+            self.size -= old_wav.nbytes
+            evicted.append((old_key, old_wav))
+        return evicted
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.pcm.z')
+
+    def _scan_spill(self):
+        # 启动时读取一次磁盘上已有的文件，之后增量维护，淘汰时不再遍历目录
+        files = []
+        for name in os.listdir(self.spill_dir):
+            if name.endswith('.pcm.z'):
+                path = os.path.join(self.spill_dir, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        self.spill_files = OrderedDict((path, size) for _, path, size in files)
+        self.spill_size = sum(self.spill_files.values())
+
+    def _spill(self, evicted):
+        if self.spill_dir is None:
+            return
+        for key, wav in evicted:
+            path = self._path(key)
+            with self.spill_lock:
+                if path in self.spill_files:
+                    continue
+            pcm = (np.clip(wav, -1, 1) * 32767).astype('<i2')
+            data = zlib.compress(pcm.tobytes())
+            # 先写临时文件再替换，读取方和中途崩溃都不会看到写了一半的文件
+            tmp = f'{path}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except OSError:
+                logging.exception('failed to spill waveform to disk')
+                continue
+            with self.spill_lock:
+                self.spill_size += len(data) - self.spill_files.pop(path, 0)
+                self.spill_files[path] = len(data)
+                self._trim_spill()
+
+    def _trim_spill(self):
+        if self.max_spill_bytes is None:
+            return
+        while self.spill_size > self.max_spill_bytes and self.spill_files:
+            path, size = self.spill_files.popitem(last=False)
+            self.spill_size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return np.frombuffer(zlib.decompress(data), dtype='<i2').astype(np.float32) / 32767
+        except (zlib.error, ValueError):
+            # 损坏的文件当作未命中并删除
+            logging.warning(f'removing corrupted waveform cache file {path}')
+            with self.spill_lock:
+                self.spill_size -= self.spill_files.pop(path, 0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0
+            }
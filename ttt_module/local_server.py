@@ -0,0 +1,137 @@
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 本地的 OpenAI 兼容对话服务，按固定的回复逐段流式返回，用于在没有 API key 的情况下测试流式链路
+# 示例用法
+# server = LocalChatServer(['[ZH]你好[ZH][JA]こんにちは[JA]'], token_delay=0.05)
+# server.start()
+# gpt = GPT('local', 1024, base_url=server.base_url)
+# for token in gpt.ask_stream('你好'):
+#     print(token)
+# server.stop()
+class LocalChatServer:
+    def __init__(self, replies, token_delay=0.0, token_size=2, host='127.0.0.1', port=0, first_token_delay=0.0):
+        """
+        :param replies: 依次循环返回的回复文本
+        :param token_delay: 每个片段之间的间隔（秒），模拟模型的生成速度
+        :param token_size: 每个片段包含的字符数
+        :param first_token_delay: 收到请求到返回第一个片段之前的额外等待（秒），模拟模型的首字延迟
+        """
+        self.replies = itertools.cycle(replies)
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.token_size = token_size
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._create_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def next_reply(self):
+        with self.lock:
+            return next(self.replies)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _create_handler(self):
+        chat_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith('/chat/completions'):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                reply = chat_server.next_reply()
+                model = body.get('model', 'local')
+                prompt_tokens = sum(len(m.get('content', '')) for m in body.get('messages', []))
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': len(reply),
+                    'total_tokens': prompt_tokens + len(reply)
+                }
+                if body.get('stream'):
+                    include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+                    try:
+                        self._stream(reply, model, usage if include_usage else None)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # 客户端中途断开（被打断），停止生成
+                        pass
+                else:
+                    self._complete(reply, model, usage)
+
+            def _complete(self, reply, model, usage):
+                time.sleep(chat_server.first_token_delay + chat_server.token_delay * len(_split(reply, chat_server.token_size)))
+                data = json.dumps({
+                    'id': 'chatcmpl-local',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': reply},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': usage
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, reply, model, usage):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                time.sleep(chat_server.first_token_delay)
+                for token in _split(reply, chat_server.token_size):
+                    time.sleep(chat_server.token_delay)
+                    self._send_event(_chunk(model, [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]))
+                self._send_event(_chunk(model, [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+                if usage is not None:
+                    self._send_event(_chunk(model, [], usage))
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+
+            def _send_event(self, data):
+                self.wfile.write(f'data: {json.dumps(data)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+
+        return Handler
+
+
+def _split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _chunk(model, choices, usage=None):
+    return {
+        'id': 'chatcmpl-local',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': choices,
+        'usage': usage
+    }
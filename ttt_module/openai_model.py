@@ -5,8 +5,11 @@ import requests
 
 
 class GPT:
-    def __init__(self, api_key, max_tokens, model='gpt-4o-mini', system_prompt='You are a helpful assistant.'):
+    def __init__(self, api_key, max_tokens, model='gpt-4o-mini', system_prompt='You are a helpful assistant.',
+                 base_url=None, max_history=None):
         self.api_key = api_key
+        # 为 None 时使用 OpenAI 官方地址，也可以指向本地的兼容服务
+        self.base_url = base_url
         self.max_tokens = max_tokens
         self.queue = False
         self.model = model
@@ -15,6 +18,8 @@ class GPT:
             'content': system_prompt
         }
         self.conversation = [self.system_prompt]
+        # 上下文最多保留的消息数（不含 system prompt） None 表示不限制
+        self.max_history = max_history
         self.cost = 0
 
     def start_queue(self):
@@ -40,7 +45,7 @@ class GPT:
     # 有上下文 但是不保存当前对话
     def ask_without_save(self, text):
         message = self._construct_message_(text)
-        client = OpenAI(api_key=self.api_key)
+        client = OpenAI(api_key=self.api_key, base_url=self.base_url)
         response = client.chat.completions.create(
             model=self.model,
             messages=message,
@@ -50,7 +55,40 @@ class GPT:
         self._calculate_cost_(response.usage.model_dump())
         return content
 
-    def ask(self, text):
+    # 流式返回 逐个产出生成的文本片段 全部产出后保存对话
+    # cancelled 为 threading.Event 置位后立即断开连接 不保存这轮对话
+    def ask_stream(self, text, cancelled=None):
+        message = self._construct_message_(text)
+        client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        stream = client.chat.completions.create(
+            model=self.model,
+            messages=message,
+            max_tokens=self.max_tokens,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        contents = []
+        for chunk in stream:
+            if cancelled is not None and cancelled.is_set():
+                # 关闭连接 服务端随之停止生成
+                stream.close()
+                return
+            if chunk.usage is not None:
+                self._calculate_cost_(chunk.usage.model_dump())
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                contents.append(token)
+                yield token
+        # 保存对话
+        self.add_user_context(text)
+        self.add_assistant_context(''.join(contents))
+
+    # 传入 cancelled 时改为流式请求并拼接 置位后立即断开连接 返回已生成的部分 不保存这轮对话
+    def ask(self, text, cancelled=None):
+        if cancelled is not None:
+            return ''.join(self.ask_stream(text, cancelled=cancelled))
         content = self.ask_without_save(text)
         # 保存对话
         self.add_user_context(text)
@@ -70,6 +108,7 @@ class GPT:
                 'role': 'user',
                 'content': text
             })
+            self._trim_context_()
 
     def add_assistant_context(self, text):
         if self.queue:
@@ -77,6 +116,15 @@ class GPT:
                 'role': 'assistant',
                 'content': text
             })
+            self._trim_context_()
+
+    # 超出 max_history 时丢弃最早的消息 保留 system prompt
+    def _trim_context_(self):
+        if self.max_history is None:
+            return
+        overflow = len(self.conversation) - 1 - self.max_history
+        if overflow > 0:
+            del self.conversation[1:1 + overflow]
 
     def _calculate_cost_(self, usage):
         self.cost += usage['completion_tokens'] * 3 + usage['prompt_tokens']
@@ -1,10 +1,19 @@
+import io
 import json
 import os
 import re
+import threading
 import wave
 
 import numpy as np
-import sounddevice as sd
+
+try:
+    import sounddevice as sd
+except OSError:
+    # 没有 PortAudio 的环境（例如无界面服务器）不能本地播放
+    sd = None
+
+from tracing import tracer
 
 
 def load_config(file_path):
@@ -48,7 +57,188 @@ def split_text_by_language(input_text):
     return result
 
 
-def play_audio(path):
+class LanguageSegmentParser:
+    """
+    增量解析 [ZH]中文[ZH] / [JA]日文[JA] 格式的文本流，每收到一个闭合标签就立即产出一段，
+    feed 与 close 的结果合起来与对完整文本调用 split_text_by_language 一致。
+
+    parser = LanguageSegmentParser()
+    for token in gpt.ask_stream(text):
+        for lang, chunk in parser.feed(token):
+            ...
+    for lang, chunk in parser.close():
+        ...
+    """
+    tag_pattern = re.compile(r'\[(ZH|JA)\]')
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, text):
+        """
+        :param text: 新收到的文本片段
+        :return: 本次新闭合的 (语言类型, 文字内容) 列表
+        """
+        self.buffer += text
+        return self._parse(final=False)
+
+    def close(self):
+        """
+        文本流结束，未闭合的开始标签不会再匹配，返回其后剩余的段
+        """
+        result = self._parse(final=True)
+        self.buffer = ''
+        return result
+
+    def _parse(self, final):
+        result = []
+        while True:
+            opening = self.tag_pattern.search(self.buffer)
+            if opening is None:
+                # 保留可能被截断的标签开头，例如 '[Z'
+                self.buffer = self.buffer[-3:]
+                break
+            lang = opening.group(1)
+            start = opening.end()
+            # 内容至少一个字符
+            end = self.buffer.find(f'[{lang}]', start + 1)
+            newline = self.buffer.find('\n', start)
+            if (newline != -1 and (end == -1 or newline < end)) or (end == -1 and final):
+                # 内容不能跨行，这个开始标签不会再匹配了
+                self.buffer = self.buffer[opening.start() + 1:]
+                continue
+            if end == -1:
+                self.buffer = self.buffer[opening.start():]
+                break
+            result.append((lang, self.buffer[start:end]))
+            self.buffer = self.buffer[end + len(lang) + 2:]
+        return result
+
+    def reset(self):
+        self.buffer = ''
+
+
+class AudioBuffer:
+    """
+    内存中的音频：采样数据、采样率和数据类型。合成、播放和口型同步直接共享同一份数据，
+    不再经过 wav 文件中转，导出 wav 只是可选的后台操作。
+    """
+
+    def __init__(self, samples, sample_rate=22050):
+        """
+        :param samples: 单声道为 [n]，多声道为 [n, channels]；已经是 numpy 数组时不会复制
+        :param sample_rate: 采样率
+        """
+        self.samples = np.asarray(samples)
+        self.sample_rate = sample_rate
+
+    @property
+    def dtype(self):
+        return self.samples.dtype
+
+    @property
+    def num_frames(self):
+        return self.samples.shape[0]
+
+    @property
+    def num_channels(self):
+        return 1 if self.samples.ndim == 1 else self.samples.shape[1]
+
+    @property
+    def duration(self):
+        return self.num_frames / self.sample_rate
+
+    def __len__(self):
+        return self.num_frames
+
+    @staticmethod
+    def concatenate(buffers, sample_rate=22050):
+        if not buffers:
+            return AudioBuffer(np.zeros(0, dtype=np.float32), sample_rate)
+        if len(buffers) == 1:
+            return buffers[0]
+        return AudioBuffer(np.concatenate([b.samples for b in buffers], axis=0), buffers[0].sample_rate)
+
+    def to_pcm16(self):
+        if self.dtype == np.int16:
+            return self.samples
+        samples = self.samples
+        if np.issubdtype(self.dtype, np.integer):
+            samples = samples / np.iinfo(self.dtype).max
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+    @staticmethod
+    def load(file):
+        """
+        :param file: wav 文件路径或文件对象
+        """
+        with wave.open(file, 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            dtype_map = {1: np.int8, 2: np.int16, 4: np.int32}
+            if sample_width not in dtype_map:
+                raise ValueError(f"不支持的样本宽度: {sample_width} 字节")
+            samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=dtype_map[sample_width])
+            if channels > 1:
+                samples = samples.reshape(-1, channels)
+            return AudioBuffer(samples, wav_file.getframerate())
+
+    def to_mono(self):
+        if self.num_channels == 1:
+            return self
+        return AudioBuffer(self.samples.mean(axis=1).astype(self.dtype), self.sample_rate)
+
+    def save(self, path):
+        """
+        :param path: wav 文件路径或文件对象
+        """
+        with tracer.span('wav.save', duration=self.duration):
+            with wave.open(path, 'wb') as wav_file:
+                wav_file.setnchannels(self.num_channels)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(self.sample_rate)
+                wav_file.writeframes(self.to_pcm16().tobytes())
+
+    def to_wav_bytes(self):
+        f = io.BytesIO()
+        self.save(f)
+        return f.getvalue()
+
+    def save_async(self, path):
+        """
+        在后台线程保存为 16 位 wav，不阻塞合成和播放
+        """
+        thread = threading.Thread(target=self.save, args=(path,), daemon=True)
+        thread.start()
+        return thread
+
+
+def stop_audio():
+    """
+    立即停止当前播放
+    """
+    if sd is not None:
+        sd.stop()
+
+
+def wait_audio():
+    """
+    等待当前播放结束
+    """
+    if sd is not None:
+        sd.wait()
+
+
+def play_audio(audio):
+    """
+    :param audio: wav 文件路径或 AudioBuffer
+    """
+    if sd is None:
+        raise RuntimeError('sounddevice 不可用，无法播放音频')
+    if isinstance(audio, AudioBuffer):
+        sd.play(audio.samples, samplerate=audio.sample_rate)
+        return
+    path = audio
     # 打开 WAV 文件
     with wave.open(path, 'rb') as wav_file:
         # 获取音频参数